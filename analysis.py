@@ -0,0 +1,155 @@
+# analysis.py
+# Анализ длинной документации о закупке по схеме map-reduce:
+# текст делится на фрагменты, из каждого параллельно извлекаются факты,
+# затем итоговый анализ строится по собранным фактам.
+import os
+import asyncio
+import logging
+import core
+import relevance
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_MAX_CHARS = int(os.getenv("ANALYSIS_MAX_CHARS", 120000))   # сколько текста документа читаем
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 2500))                  # размер фрагмента в токенах
+CHARS_PER_TOKEN = 3                                                  # грубая оценка для русского текста
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", 8))     # одновременных запросов к GigaChat
+
+NO_DATA = "нет данных"
+
+MAP_SYSTEM_PROMPT = """Ты — эксперт по госзакупкам (44-ФЗ, 223-ФЗ). Тебе дают фрагмент документации о закупке.
+Выпиши из фрагмента только конкретные факты, если они есть:
+- предмет закупки, НМЦК, сроки подачи заявок и исполнения контракта;
+- требования к участникам и перечень документов в составе заявки;
+- размер и порядок обеспечения заявки;
+- размер и порядок обеспечения исполнения контракта;
+- гарантийные обязательства и их обеспечение;
+- существенные условия и риски проекта контракта (штрафы, сроки оплаты, приёмка).
+Пиши кратко, списком, с цифрами и номерами пунктов. Ничего не придумывай.
+Если нужных сведений во фрагменте нет, ответь ровно: «нет данных»."""
+
+# Извлечение фактов — часть анализа документа: по умолчанию Pro, короткий
+# ответ и низкая температура (модель меняется через TASK_MODELS)
+MAP_MAX_TOKENS = int(os.getenv("MAP_MAX_TOKENS", 600))
+core.register_task("map", MAP_SYSTEM_PROMPT, max_tokens=MAP_MAX_TOKENS, temperature=0.2)
+
+REDUCE_SYSTEM_PROMPT = """Ты — эксперт по госзакупкам (44-ФЗ, 223-ФЗ). Тебе дают факты, извлечённые из нескольких частей документации о закупке.
+Объедини их в один краткий список: убери повторы, сохрани все цифры, сроки, суммы, проценты и номера пунктов.
+Не теряй сведения об обеспечении заявки, исполнения контракта и гарантийных обязательств.
+Ничего не придумывай."""
+REDUCE_MAX_ROUNDS = 3   # раундов сжатия фактов, не поместившихся в бюджет
+core.register_task("reduce", REDUCE_SYSTEM_PROMPT, max_tokens=MAP_MAX_TOKENS, temperature=0.2)
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_chunks(text: str, chunk_chars: int = None) -> list:
+    """Делит текст на фрагменты по границам абзацев (не длиннее chunk_chars)"""
+    chunk_chars = chunk_chars or CHUNK_TOKENS * CHARS_PER_TOKEN
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in text.split("\n"):
+        # Слишком длинный абзац режем по длине
+        while len(paragraph) > chunk_chars:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.append(paragraph[:chunk_chars])
+            paragraph = paragraph[chunk_chars:]
+        if size + len(paragraph) + 1 > chunk_chars and current:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 1
+    if current and "".join(current).strip():
+        chunks.append("\n".join(current))
+    return chunks
+
+def document_prompt(text: str) -> str:
+    """Запрос на анализ документа, целиком помещающегося в один вызов"""
+    return f"Проанализируй этот документ о закупке: {text}"
+
+async def _extract_facts(index: int, total: int, chunk: str, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        try:
+            facts = await core.request_completion(
+                f"Фрагмент {index} из {total}:\n{chunk}",
+                task="map",
+            )
+        except core.GigaChatError as e:
+            logger.warning("Chunk %d/%d analysis failed: %s", index, total, e)
+            return None
+    facts = facts.strip()
+    if not facts or facts.strip(" .«»\"").lower() == NO_DATA:
+        return None
+    return facts
+
+def _group_facts(facts: list, group_chars: int) -> list:
+    """Соседние части, объединённые в группы не длиннее group_chars"""
+    groups = []
+    for fact in facts:
+        if groups and sum(len(f) for f in groups[-1]) + len(fact) <= group_chars:
+            groups[-1].append(fact)
+        else:
+            groups.append([fact])
+    return groups
+
+async def _reduce_group(group: list, semaphore: asyncio.Semaphore) -> str:
+    combined = "\n\n".join(group)
+    if len(group) == 1 and len(combined) <= MAP_MAX_TOKENS * CHARS_PER_TOKEN:
+        return combined
+    async with semaphore:
+        try:
+            reduced = await core.request_completion(combined, task="reduce")
+        except core.GigaChatError as e:
+            logger.warning("Facts reduction failed: %s", e)
+            return combined
+    return reduced.strip() or combined
+
+async def compress_facts(facts: list, budget: int, semaphore: asyncio.Semaphore) -> list:
+    """Сжимает факты группами соседних частей, пока они не поместятся в budget
+
+    Если и после REDUCE_MAX_ROUNDS раундов места не хватает, каждая группа
+    обрезается до равной доли бюджета — сведения из последних частей
+    документа не отбрасываются целиком.
+    """
+    group_chars = CHUNK_TOKENS * CHARS_PER_TOKEN
+    for _ in range(REDUCE_MAX_ROUNDS):
+        if sum(len(f) + 2 for f in facts) <= budget:
+            return facts
+        groups = _group_facts(facts, group_chars)
+        facts = list(await asyncio.gather(*[_reduce_group(group, semaphore) for group in groups]))
+    share = budget // len(facts) - 2
+    return [f[:share] for f in facts]
+
+async def build_document_context(text: str) -> str:
+    """Материал документа для анализа (и для последующих вопросов по нему)
+
+    Короткий документ отправляется как есть. Из длинного по BM25-индексу
+    отбираются разделы, относящиеся к закупке; если они не помещаются в один
+    запрос, они делятся на фрагменты, факты из которых извлекаются
+    параллельно (не больше ANALYSIS_CONCURRENCY запросов одновременно)
+    и сводятся в один запрос.
+    """
+    budget = core.EXTRACT_MAX_CHARS
+    if len(text) <= budget:
+        return text
+
+    focused = relevance.select_relevant(text)
+    if len(focused) <= budget:
+        return focused
+
+    chunks = split_chunks(focused)
+    semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    results = await asyncio.gather(*[
+        _extract_facts(i, len(chunks), chunk, semaphore)
+        for i, chunk in enumerate(chunks, 1)
+    ])
+    facts = [f"[Часть {i}]\n{r}" for i, r in enumerate(results, 1) if r]
+    if not facts:
+        # Сводка не получилась — анализируем самые релевантные разделы
+        return relevance.select_relevant(text, budget)
+
+    summary = "\n\n".join(await compress_facts(facts, budget, semaphore))
+    return f"Документ большой, ниже — сведения, извлечённые из всех его частей ({len(chunks)}):\n\n{summary}"
@@ -0,0 +1,229 @@
+# bench/mocks.py
+# Локальные заглушки MAX API и GigaChat для нагрузочного тестирования.
+# Задержка, доля ошибок и скорость потоковой выдачи настраиваются; заглушка
+# MAX запоминает все исходящие вызовы бота (GET /_bench/calls).
+#
+# Отдельный запуск:
+#   python bench/mocks.py --max-port 8081 --gigachat-port 8082 --gigachat-latency 0.8
+import time
+import json
+import random
+import asyncio
+import argparse
+from aiohttp import web
+
+ANSWER = (
+    "**Требования к участникам:** выписка из ЕГРЮЛ, декларация о соответствии "
+    "требованиям ст. 31 44-ФЗ, документы, подтверждающие опыт.\n"
+    "**Обеспечение заявки:** 1% НМЦК. **Обеспечение исполнения контракта:** 5% цены контракта.\n"
+    "ООО \"Тритика\" поможет подготовить заявку: +7(4922)223-222."
+)
+
+DOCUMENT_TEXT = (
+    "Раздел {n}. Требования к участникам закупки. Участник должен соответствовать "
+    "требованиям статьи 31 Федерального закона 44-ФЗ. Размер обеспечения заявки "
+    "составляет 1 процент начальной (максимальной) цены контракта. Обеспечение "
+    "исполнения контракта — 5 процентов. Срок поставки товара — 30 дней.\n"
+)
+
+class MockConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, retry_after=None,
+                 stream_chunks=20, stream_interval=0.05, document_kb=64):
+        self.latency = latency            # базовая задержка ответа, сек.
+        self.jitter = jitter              # случайная добавка к задержке, сек.
+        self.error_rate = error_rate      # доля ответов с ошибкой
+        self.error_status = error_status
+        self.retry_after = retry_after    # значение Retry-After в ответах с ошибкой
+        self.stream_chunks = stream_chunks
+        self.stream_interval = stream_interval
+        self.document_kb = document_kb    # размер отдаваемого документа
+
+    async def delay(self):
+        total = self.latency + random.uniform(0, self.jitter)
+        if total > 0:
+            await asyncio.sleep(total)
+
+    def error_response(self):
+        """Ответ-ошибка с вероятностью error_rate (иначе None)"""
+        if self.error_rate <= 0 or random.random() >= self.error_rate:
+            return None
+        headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+        return web.json_response({"error": "mock failure"}, status=self.error_status, headers=headers)
+
+class CallRecorder:
+    """Журнал исходящих вызовов бота: (время, метод, chat_id)"""
+
+    def __init__(self):
+        self.calls = []
+
+    def record(self, method, chat_id):
+        self.calls.append({"t": time.time(), "method": method, "chat_id": chat_id})
+
+def build_max_app(config: MockConfig, recorder: CallRecorder) -> web.Application:
+    message_ids = iter(range(1, 10 ** 12))
+    document = "".join(DOCUMENT_TEXT.format(n=n) for n in range(config.document_kb * 1024 // len(DOCUMENT_TEXT) + 1))
+
+    async def send(request, method):
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            chat_id = form.get("chat_id")
+        else:
+            chat_id = (await request.json()).get("chat_id")
+        await config.delay()
+        error = config.error_response()
+        if error is not None:
+            return error
+        recorder.record(method, int(chat_id) if chat_id is not None else None)
+        return web.json_response({"ok": True, "result": {"message_id": next(message_ids)}})
+
+    async def send_message(request):
+        return await send(request, "sendMessage")
+
+    async def edit_message(request):
+        return await send(request, "editMessageText")
+
+    async def send_document(request):
+        return await send(request, "sendDocument")
+
+    async def get_file(request):
+        await config.delay()
+        file_id = request.query.get("file_id", "file")
+        data = document.encode()
+        return web.json_response({"ok": True, "result": {"file_path": f"{file_id}.txt", "file_size": len(data)}})
+
+    async def download(request):
+        await config.delay()
+        return web.Response(body=document.encode(), content_type="text/plain")
+
+    async def calls(request):
+        return web.json_response(recorder.calls)
+
+    async def reset(request):
+        recorder.calls.clear()
+        return web.json_response({"ok": True})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/sendMessage", send_message)
+    app.router.add_post("/editMessageText", edit_message)
+    app.router.add_post("/sendDocument", send_document)
+    app.router.add_get("/getFile", get_file)
+    app.router.add_get("/file/{path:.*}", download)
+    app.router.add_get("/_bench/calls", calls)
+    app.router.add_post("/_bench/reset", reset)
+    return app
+
+def build_gigachat_app(config: MockConfig) -> web.Application:
+    stats = {"tokens": 0, "completions": 0, "streams": 0, "errors": 0, "models": {}}
+
+    def usage(data):
+        """Условный расход токенов (по 3 символа на токен) и учёт запросов по моделям"""
+        model = data.get("model", "")
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        prompt = sum(len(m.get("content", "")) for m in data.get("messages", [])) // 3 + 1
+        completion = len(ANSWER) // 3 + 1
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def oauth(request):
+        stats["tokens"] += 1
+        return web.json_response({
+            "access_token": f"mock-{stats['tokens']}",
+            "expires_at": int((time.time() + 1800) * 1000),
+        })
+
+    async def completions(request):
+        data = await request.json()
+        await config.delay()
+        error = config.error_response()
+        if error is not None:
+            stats["errors"] += 1
+            return error
+        if not data.get("stream"):
+            stats["completions"] += 1
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": ANSWER}}],
+                                      "usage": usage(data)})
+
+        stats["streams"] += 1
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        size = max(1, len(ANSWER) // config.stream_chunks)
+        for i in range(0, len(ANSWER), size):
+            chunk = {"choices": [{"delta": {"content": ANSWER[i:i + size]}}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(config.stream_interval)
+        # Как и GigaChat, расход токенов — в последнем фрагменте
+        chunk = {"choices": [{"delta": {"content": ""}, "finish_reason": "stop"}], "usage": usage(data)}
+        await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/api/v2/oauth", oauth)
+    app.router.add_post("/api/v1/chat/completions", completions)
+    app.router.add_get("/_bench/stats", get_stats)
+    return app
+
+async def start_site(app, port, host="127.0.0.1") -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def add_mock_arguments(parser):
+    parser.add_argument("--max-port", type=int, default=8081)
+    parser.add_argument("--gigachat-port", type=int, default=8082)
+    parser.add_argument("--max-latency", type=float, default=0.03, help="задержка MAX API, сек.")
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--gigachat-latency", type=float, default=0.5, help="задержка GigaChat, сек.")
+    parser.add_argument("--gigachat-jitter", type=float, default=0.3)
+    parser.add_argument("--gigachat-error-rate", type=float, default=0.0)
+    parser.add_argument("--gigachat-error-status", type=int, default=429)
+    parser.add_argument("--gigachat-retry-after", type=float, default=None)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--stream-interval", type=float, default=0.05, help="пауза между фрагментами, сек.")
+    parser.add_argument("--document-kb", type=int, default=64, help="размер отдаваемого документа")
+
+async def start_mocks(args):
+    """Запускает обе заглушки; возвращает (раннеры, журнал вызовов MAX)"""
+    recorder = CallRecorder()
+    max_config = MockConfig(latency=args.max_latency, error_rate=args.max_error_rate,
+                            error_status=503, document_kb=args.document_kb)
+    gigachat_config = MockConfig(latency=args.gigachat_latency, jitter=args.gigachat_jitter,
+                                 error_rate=args.gigachat_error_rate, error_status=args.gigachat_error_status,
+                                 retry_after=args.gigachat_retry_after, stream_chunks=args.stream_chunks,
+                                 stream_interval=args.stream_interval)
+    runners = [
+        await start_site(build_max_app(max_config, recorder), args.max_port),
+        await start_site(build_gigachat_app(gigachat_config), args.gigachat_port),
+    ]
+    return runners, recorder
+
+def mock_env(args) -> dict:
+    """Переменные окружения, направляющие бота на заглушки"""
+    return {
+        "MAX_API_URL": f"http://127.0.0.1:{args.max_port}",
+        "GIGACHAT_TOKEN_URL": f"http://127.0.0.1:{args.gigachat_port}/api/v2/oauth",
+        "GIGACHAT_CHAT_URL": f"http://127.0.0.1:{args.gigachat_port}/api/v1/chat/completions",
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Заглушки MAX API и GigaChat")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    runners, _ = await start_mocks(args)
+    for name, value in mock_env(args).items():
+        print(f"{name}={value}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
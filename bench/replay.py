@@ -0,0 +1,168 @@
+# bench/replay.py
+# Отправка записанных обновлений на /webhook бота и отчёт о задержках.
+#
+# Для каждого обновления измеряется время ответа webhook (ack) и, если
+# доступен журнал заглушки MAX, полное время обработки — до последнего
+# вызова MAX API для этого чата. Каждому обновлению по умолчанию выдаётся
+# свой chat_id, чтобы полные задержки не смешивались.
+#
+# Отдельный запуск (бот и заглушки уже работают):
+#   python bench/replay.py --bot http://127.0.0.1:5000 --max-mock http://127.0.0.1:8081 -n 500 -c 50
+import os
+import copy
+import math
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+DEFAULT_UPDATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "updates.jsonl")
+CHAT_ID_BASE = 10 ** 9   # чаты бенчмарка не пересекаются с настоящими
+
+def load_updates(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def set_chat_id(update, chat_id):
+    update = copy.deepcopy(update)
+    if update.get("update_type") == "new_message":
+        update["message"].setdefault("chat", {})["chat_id"] = chat_id
+    else:
+        update["chat_id"] = chat_id
+    return update
+
+def build_workload(updates, count, unique_chats=True) -> list:
+    """count обновлений по кругу из записанных; каждому — свой чат"""
+    workload = []
+    for i in range(count):
+        update = updates[i % len(updates)]
+        workload.append(set_chat_id(update, CHAT_ID_BASE + i) if unique_chats else update)
+    return workload
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(values) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "p99": round(percentile(values, 99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+async def replay(webhook_url, workload, concurrency=50, rate=None):
+    """Отправляет обновления; возвращает [(chat_id, отправлено, ack сек., HTTP-статус)]"""
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+    interval = 1 / rate if rate else 0
+
+    async def post(session, update):
+        async with semaphore:
+            chat_id = update.get("chat_id") or update.get("message", {}).get("chat", {}).get("chat_id")
+            sent_at = time.time()
+            started = time.monotonic()
+            try:
+                async with session.post(webhook_url, json=update) as resp:
+                    await resp.read()
+                    status = resp.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            results.append((chat_id, sent_at, time.monotonic() - started, status))
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        tasks = []
+        for update in workload:
+            tasks.append(asyncio.create_task(post(session, update)))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+    return results
+
+async def reset_calls(max_mock_url):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{max_mock_url}/_bench/reset") as resp:
+            resp.raise_for_status()
+
+async def fetch_calls(max_mock_url) -> list:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{max_mock_url}/_bench/calls") as resp:
+            return await resp.json()
+
+async def wait_settled(max_mock_url, idle=3.0, timeout=600.0) -> list:
+    """Ждёт, пока бот перестанет обращаться к MAX API в течение idle секунд"""
+    deadline = time.monotonic() + timeout
+    calls = await fetch_calls(max_mock_url)
+    last_count, last_change = len(calls), time.monotonic()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        calls = await fetch_calls(max_mock_url)
+        if len(calls) != last_count:
+            last_count, last_change = len(calls), time.monotonic()
+        elif time.monotonic() - last_change >= idle:
+            break
+    return calls
+
+def report(results, calls, started, finished) -> dict:
+    """Сводка: пропускная способность, задержки ack и полной обработки"""
+    acks = [r[2] for r in results]
+    statuses = {}
+    for r in results:
+        statuses[str(r[3])] = statuses.get(str(r[3]), 0) + 1
+
+    last_call = {}
+    for call in calls or []:
+        chat_id = call.get("chat_id")
+        last_call[chat_id] = max(last_call.get(chat_id, 0), call["t"])
+    end_to_end = [last_call[chat_id] - sent_at for chat_id, sent_at, _, _ in results if chat_id in last_call]
+
+    elapsed = finished - started
+    result = {
+        "updates": len(results),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "statuses": statuses,
+        "ack": summarize(acks),
+    }
+    if calls is not None:
+        result["end_to_end"] = summarize(end_to_end)
+        result["unanswered"] = len(results) - len(end_to_end)
+        if end_to_end:
+            done = max(last_call[chat_id] for chat_id, *_ in results if chat_id in last_call)
+            result["processed_per_sec"] = round(len(end_to_end) / (done - min(r[1] for r in results)), 2)
+    return result
+
+def add_replay_arguments(parser):
+    parser.add_argument("--updates", default=DEFAULT_UPDATES, help="JSONL с записанными обновлениями")
+    parser.add_argument("-n", "--count", type=int, default=200, help="сколько обновлений отправить")
+    parser.add_argument("-c", "--concurrency", type=int, default=50, help="одновременных запросов к webhook")
+    parser.add_argument("--rate", type=float, default=None, help="обновлений в секунду (по умолчанию без паузы)")
+    parser.add_argument("--same-chats", action="store_true", help="не подменять chat_id из записи")
+    parser.add_argument("--settle", type=float, default=3.0,
+                        help="сколько секунд тишины в MAX API считать окончанием обработки")
+
+async def run_replay(args, bot_url, max_mock_url=None) -> dict:
+    workload = build_workload(load_updates(args.updates), args.count, unique_chats=not args.same_chats)
+    if max_mock_url:
+        await reset_calls(max_mock_url)
+    started = time.time()
+    results = await replay(f"{bot_url}/webhook", workload, args.concurrency, args.rate)
+    finished = time.time()
+    calls = await wait_settled(max_mock_url, idle=args.settle) if max_mock_url else None
+    return report(results, calls, started, finished)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на /webhook записанными обновлениями")
+    parser.add_argument("--bot", default="http://127.0.0.1:5000", help="адрес бота")
+    parser.add_argument("--max-mock", default=None, help="адрес заглушки MAX (для полных задержек)")
+    add_replay_arguments(parser)
+    args = parser.parse_args()
+    print(json.dumps(await run_replay(args, args.bot, args.max_mock), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
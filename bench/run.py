@@ -0,0 +1,91 @@
+# bench/run.py
+# Полный прогон без внешних сервисов: поднимает заглушки MAX и GigaChat,
+# запускает bot_max.py с адресами заглушек, отправляет обновления на /webhook
+# и печатает отчёт (p50/p95/p99, обновлений в секунду) вместе с /stats бота.
+#
+#   python bench/run.py -n 500 -c 50 --gigachat-latency 0.8 --gigachat-error-rate 0.05
+#
+# Прочие настройки бота (WORKER_COUNT, STREAM_RESPONSES, CACHE_ENABLED, ...)
+# берутся из окружения как обычно. Журнал бота пишется в отдельный файл
+# (--bot-log), в stdout попадает только отчёт в JSON.
+import os
+import sys
+import json
+import tempfile
+import asyncio
+import argparse
+import aiohttp
+from mocks import add_mock_arguments, start_mocks, mock_env
+from replay import add_replay_arguments, run_replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def bot_env(args) -> dict:
+    env = dict(os.environ)
+    # Значения по умолчанию, не мешающие измерению; явно заданные в окружении важнее
+    defaults = {
+        "MAX_BOT_TOKEN": "bench",
+        "ADMIN_CHAT_ID": "1",
+        "MANAGER_CHAT_ID": "2",
+        "GIGACHAT_CLIENT_ID": "bench",
+        "GIGACHAT_CLIENT_SECRET": "bench",
+        "GLOBAL_RATE": "100000",
+        "GLOBAL_BURST": "100000",
+        "STATE_BACKEND": "memory",
+        "LOG_LEVEL": "WARNING",
+    }
+    for name, value in defaults.items():
+        env.setdefault(name, value)
+    env.update(mock_env(args))
+    env["PORT"] = str(args.bot_port)
+    return env
+
+async def wait_ready(url, timeout=30.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while asyncio.get_running_loop().time() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Bot did not start at {url}")
+
+async def fetch_json(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.json()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на локальных заглушках")
+    parser.add_argument("--bot-port", type=int, default=5055)
+    parser.add_argument("--bot-log", default=os.path.join(tempfile.gettempdir(), "tenderbot-bench.log"),
+                        help="файл для stdout/stderr бота")
+    add_mock_arguments(parser)
+    add_replay_arguments(parser)
+    args = parser.parse_args()
+
+    runners, _ = await start_mocks(args)
+    print(f"Bot log: {args.bot_log}", file=sys.stderr)
+    bot_log = open(args.bot_log, "w", encoding="utf-8")
+    bot = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "bot_max.py"),
+                                               cwd=ROOT, env=bot_env(args),
+                                               stdout=bot_log, stderr=asyncio.subprocess.STDOUT)
+    bot_url = f"http://127.0.0.1:{args.bot_port}"
+    try:
+        await wait_ready(bot_url)
+        result = await run_replay(args, bot_url, f"http://127.0.0.1:{args.max_port}")
+        result["bot_stats"] = await fetch_json(f"{bot_url}/stats")
+        result["gigachat_mock"] = await fetch_json(f"http://127.0.0.1:{args.gigachat_port}/_bench/stats")
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    finally:
+        bot.terminate()
+        await bot.wait()
+        bot_log.close()
+        for runner in runners:
+            await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
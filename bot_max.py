@@ -1,23 +1,19 @@
 import os
-import json
+import time
+import hashlib
 import logging
-import tempfile
-import requests
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-import aiohttp  # оставим для скачивания файлов, если нужно асинхронно, но можно и requests
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, FormData
+from dotenv import load_dotenv
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Настройка логирования (вывод через очередь в отдельном потоке, см. logs.py)
+import logs
+logs.setup()
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
 # === Конфигурация ===
 BOT_TOKEN = os.getenv('MAX_BOT_TOKEN')
 if not BOT_TOKEN:
@@ -30,243 +26,614 @@ if ADMIN_CHAT_ID == 0 or MANAGER_CHAT_ID == 0:
     logger.error("ADMIN_CHAT_ID and MANAGER_CHAT_ID must be set")
     exit(1)
 
-MAX_API_URL = 'https://platform-api.max.ru'
+MAX_API_URL = os.getenv('MAX_API_URL', 'https://platform-api.max.ru')
+DOWNLOAD_CHUNK = int(os.getenv('DOWNLOAD_CHUNK', 64 * 1024))  # байт за одно чтение при скачивании
+
+# Режим приёма обновлений: "queue" — webhook сразу отвечает, обработка в фоне;
+# "sync" — обработка внутри запроса (как раньше)
+INGEST_MODE = os.getenv('INGEST_MODE', 'queue')
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 64))
+QUEUE_MAXSIZE = int(os.getenv('QUEUE_MAXSIZE', 1000))  # на одного воркера
 
-# === Хранилища состояний ===
-user_states = {}          # user_id -> состояние (например, "main", "manual_mode")
-message_to_user_map = {}  # message_id -> user_id (для ответов менеджера)
+# Потоковые ответы: заглушка "Обрабатываю..." постепенно заменяется текстом ответа
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') == '1'
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))  # сек. между правками
 
 # === Импорт бизнес-логики ===
 try:
     import core  # ваш модуль с функциями chat_completion и extract_text_from_document
+    import http_client
+    import cache
+    import analysis
+    import state
+    import conversation
+    import limits
+    import delivery
+    import metrics
+    import intents
+    import ocr
     logger.info("Core module imported")
 except ImportError as e:
-    logger.error(f"Failed to import core: {e}")
+    logger.error("Failed to import core: %s", e)
     exit(1)
 
+# === Хранилище состояний ===
+# Режим пользователя ("main", "manual_mode") и связь пересланных менеджеру
+# сообщений с пользователями; бэкенд задаётся STATE_BACKEND (memory/sqlite/redis)
+state_store = state.create_store()
+
 # === Вспомогательные функции для работы с MAX API ===
+# Все вызовы идут через общую aiohttp-сессию в том же event loop,
+# что и webhook и запросы к GigaChat. Временные ошибки (429, 5xx, сеть)
+# повторяются с паузой; при серии ошибок выключатель перестаёт слать запросы.
 
-def send_message(chat_id, text, parse_mode=None, reply_markup=None):
-    """Отправка текстового сообщения"""
-    url = f"{MAX_API_URL}/sendMessage"
+max_api_breaker = delivery.CircuitBreaker("max_api")
+
+async def call_max_api(method, path, retries=delivery.SEND_MAX_RETRIES, make_form=None, **kwargs):
+    """Запрос к MAX API с повторами; make_form() собирает FormData заново для каждой попытки"""
+    url = f"{MAX_API_URL}/{path}"
     headers = {'Authorization': BOT_TOKEN}
+
+    async def attempt():
+        if make_form is not None:
+            kwargs['data'] = make_form()
+        async with http_client.get_session().request(method, url, headers=headers, **kwargs) as r:
+            if r.status >= 400:
+                metrics.http_error("max_api", r.status)
+            if r.status == 429 or r.status >= 500:
+                raise delivery.RetryableError(f"HTTP {r.status}", limits.retry_after(r.headers),
+                                              throttled=r.status == 429)
+            r.raise_for_status()
+            return await r.json()
+
+    return await delivery.call_with_retries(attempt, max_api_breaker, retries)
+
+async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
+    """Отправка текстового сообщения"""
     data = {'chat_id': chat_id, 'text': text}
     if parse_mode:
         data['parse_mode'] = parse_mode
     if reply_markup:
         data['reply_markup'] = reply_markup
     try:
-        r = requests.post(url, headers=headers, json=data)
-        r.raise_for_status()
-        return r.json()
+        with metrics.stage("send"):
+            return await call_max_api('POST', 'sendMessage', json=data)
     except Exception as e:
-        logger.error(f"send_message error: {e}")
+        logger.error("send_message error: %r", e)
         return None
 
-def send_document(chat_id, file_data, filename, caption=None):
-    """Отправка документа"""
-    url = f"{MAX_API_URL}/sendDocument"
-    headers = {'Authorization': BOT_TOKEN}
-    files = {'document': (filename, file_data)}
-    data = {'chat_id': chat_id}
-    if caption:
-        data['caption'] = caption
+async def edit_message(chat_id, message_id, text, retries=delivery.SEND_MAX_RETRIES):
+    """Изменение текста ранее отправленного сообщения"""
+    data = {'chat_id': chat_id, 'message_id': message_id, 'text': text}
     try:
-        r = requests.post(url, headers=headers, data=data, files=files)
-        r.raise_for_status()
-        return r.json()
+        with metrics.stage("send"):
+            return await call_max_api('POST', 'editMessageText', retries=retries, json=data)
     except Exception as e:
-        logger.error(f"send_document error: {e}")
+        logger.error("edit_message error: %r", e)
         return None
 
-def get_file(file_id):
-    """Получение информации о файле и его содержимого"""
-    # 1. Получаем file_path
-    url = f"{MAX_API_URL}/getFile?file_id={file_id}"
-    headers = {'Authorization': BOT_TOKEN}
-    r = requests.get(url, headers=headers)
-    r.raise_for_status()
-    file_info = r.json()
-    file_path = file_info['result']['file_path']
-    
-    # 2. Скачиваем файл
-    file_url = f"{MAX_API_URL}/file/{file_path}?token={BOT_TOKEN}"
-    r = requests.get(file_url)
-    r.raise_for_status()
-    return r.content
+async def send_document(chat_id, file_data, filename, caption=None):
+    """Отправка документа
+
+    file_data — байты или асинхронный итератор частей (передаётся потоком,
+    без повторов: прочитанные части не вернуть).
+    """
+    retries = delivery.SEND_MAX_RETRIES if isinstance(file_data, (bytes, bytearray)) else 0
+    def make_form():
+        form = FormData()
+        form.add_field('chat_id', str(chat_id))
+        if caption:
+            form.add_field('caption', caption)
+        form.add_field('document', file_data, filename=filename)
+        return form
+
+    try:
+        with metrics.stage("send"):
+            return await call_max_api('POST', 'sendDocument', retries=retries, make_form=make_form)
+    except Exception as e:
+        logger.error("send_document error: %r", e)
+        return None
+
+async def notify_admin(text):
+    return await send_message(ADMIN_CHAT_ID, text)
+
+# Уведомления администратору о запросах копятся и уходят сводкой в фоне
+admin_digest = delivery.Digest(notify_admin, "📨 Запросы пользователей")
+
+class FileTooLarge(Exception):
+    """Файл больше допустимого размера"""
+
+class Download:
+    """Скачанный файл и его SHA-256, посчитанный по ходу загрузки"""
+
+    def __init__(self, data, sha256):
+        self.data = data
+        self.sha256 = sha256
+
+async def file_url(file_id, max_size=None):
+    """Адрес для скачивания файла; размер из getFile проверяется до загрузки"""
+    file_info = await call_max_api('GET', 'getFile', params={'file_id': file_id})
+    if max_size and file_info['result'].get('file_size', 0) > max_size:
+        raise FileTooLarge(file_info['result']['file_size'])
+    return f"{MAX_API_URL}/file/{file_info['result']['file_path']}"
+
+async def iter_file(file_id, max_size=None):
+    """Содержимое файла частями по DOWNLOAD_CHUNK; превышение max_size прерывает загрузку"""
+    url = await file_url(file_id, max_size)
+    async with http_client.get_session().get(url, params={'token': BOT_TOKEN}) as r:
+        r.raise_for_status()
+        if max_size and (r.content_length or 0) > max_size:
+            raise FileTooLarge(r.content_length)
+        size = 0
+        async for chunk in r.content.iter_chunked(DOWNLOAD_CHUNK):
+            size += len(chunk)
+            # Content-Length может отсутствовать или быть неверным — считаем сами
+            if max_size and size > max_size:
+                raise FileTooLarge(size)
+            yield chunk
+
+async def get_file(file_id, max_size=None):
+    """Скачивает файл целиком (не больше max_size байт) и считает его хеш"""
+    data = bytearray()
+    digest = hashlib.sha256()
+    async for chunk in iter_file(file_id, max_size):
+        digest.update(chunk)
+        data += chunk
+    return Download(data, digest.hexdigest())
+
+# === Ответ пользователю ===
+
+def sent_message_id(sent):
+    """message_id из ответа sendMessage (или None)"""
+    return sent['result']['message_id'] if sent and 'result' in sent else None
+
+async def reply_with_completion(chat_id, prompt, placeholder=None, message_id=None, cache_key=None, history=None,
+                                task="chat"):
+    """Заменяет заглушку ответом GigaChat (потоково, если включено)
+
+    history — предыдущие сообщения диалога; task — тип запроса (core.TASKS). Возвращает текст ответа
+    или None, если вместо ответа пользователь получил сообщение об ошибке.
+    """
+    if message_id is None and placeholder:
+        message_id = sent_message_id(await send_message(chat_id, placeholder))
+
+    if not STREAM_RESPONSES or message_id is None:
+        try:
+            response = await core.request_completion(prompt, cache_key=cache_key, task=task, history=history)
+        except core.GigaChatError as e:
+            await send_message(chat_id, str(e))
+            return None
+        await send_message(chat_id, response)
+        return response
+
+    text = ""
+    error = None
+    last_edit = time.monotonic()
+    try:
+        async for chunk in core.chat_completion_stream(prompt, cache_key=cache_key, history=history, task=task):
+            text += chunk
+            # Правки ограничены по частоте, чтобы не упираться в лимиты MAX API
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL and text.strip():
+                # Промежуточные правки не повторяем: следующая всё равно их перекроет
+                await edit_message(chat_id, message_id, text + " ▌", retries=0)
+                last_edit = time.monotonic()
+    except core.GigaChatError as e:
+        error = str(e)
+
+    # Финальная правка с полным текстом (без курсора)
+    answer = None if error else text
+    if error:
+        text = f"{text}\n\n{error}" if text.strip() else error
+    if not await edit_message(chat_id, message_id, text):
+        await send_message(chat_id, text)
+    return answer
 
 # === Обработчики команд и сообщений ===
 
-def handle_start(chat_id):
+def file_too_large_text():
+    return f"❌ Файл слишком большой. Максимальный размер для анализа — {core.MAX_FILE_SIZE // (1024 * 1024)} МБ."
+
+async def handle_start(chat_id):
     """Приветствие и установка состояния"""
-    user_states[chat_id] = "main"
-    send_message(chat_id, 
-                 "👋 Добро пожаловать в ООО 'Тритика'!\n\nВыберите действие:",
-                 reply_markup=None)  # при необходимости можно добавить клавиатуру
+    await state_store.set_user_state(chat_id, "main")
+    await conversation.reset(state_store, chat_id)
+    await send_message(chat_id,
+                       "👋 Добро пожаловать в ООО 'Тритика'!\n\nВыберите действие:",
+                       reply_markup=None)  # при необходимости можно добавить клавиатуру
 
-def handle_text(chat_id, text, user_info):
+async def handle_text(chat_id, text, user_info):
     """Обработка текстовых сообщений"""
-    state = user_states.get(chat_id, "main")
-    
+    state = await state_store.get_user_state(chat_id)
+
     if state == "manual_mode":
         # Пересылка менеджеру
         forward_text = f"📩 <b>Сообщение от пользователя:</b>\n\n{user_info}\n\n{text}"
-        sent = send_message(MANAGER_CHAT_ID, forward_text, parse_mode="html")
+        sent = await send_message(MANAGER_CHAT_ID, forward_text, parse_mode="html")
         if sent and 'result' in sent:
-            message_to_user_map[sent['result']['message_id']] = chat_id
-        send_message(chat_id, "✅ Ваше сообщение переслано менеджеру. Он ответит вам в ближайшее время.")
+            await state_store.remember_forward(sent['result']['message_id'], chat_id)
+        await send_message(chat_id, "✅ Ваше сообщение переслано менеджеру. Он ответит вам в ближайшее время.")
         return
-    
-    # Уведомление администратору
-    try:
-        send_message(ADMIN_CHAT_ID, f"📨 Запрос от {user_info}:\n{text[:200]}")
-    except:
-        pass
-    
-    send_message(chat_id, "⏳ Обрабатываю ваш запрос...")
-    
-    # Вызов бизнес-логики (core.chat_completion может быть синхронной или асинхронной)
+
+    # Уведомление администратору (попадёт в ближайшую сводку)
+    admin_digest.add(f"{user_info}:\n{text[:200]}")
+
+    # Цены и контакты отвечаем сразу из прайс-листов, без GigaChat
+    intent, answer = intents.route(text)
+    if answer:
+        metrics.fast_path.inc(intent=intent)
+        await send_message(chat_id, answer)
+        await conversation.add_exchange(state_store, chat_id, text, answer)
+        return
+
+    # Вызов бизнес-логики: вопрос уходит вместе с историей диалога
+    # (и текстом последнего документа), чтобы уточнения не требовали повторной загрузки
     try:
-        if asyncio.iscoroutinefunction(core.chat_completion):
-            # Если асинхронная, запускаем в цикле событий
-            loop = asyncio.new_event_loop()
-            response = loop.run_until_complete(core.chat_completion(text))
-            loop.close()
-        else:
-            response = core.chat_completion(text)
-        send_message(chat_id, response)
+        history = await conversation.build_history(state_store, chat_id)
+        answer = await reply_with_completion(chat_id, text, "⏳ Обрабатываю ваш запрос...", history=history)
+        if answer:
+            await conversation.add_exchange(state_store, chat_id, text, answer)
     except Exception as e:
         logger.exception("Error in chat_completion")
-        send_message(chat_id, "❌ Произошла ошибка при обработке запроса.")
+        await send_message(chat_id, "❌ Произошла ошибка при обработке запроса.")
 
-def handle_document(chat_id, file_id, file_name, user_info):
+async def handle_document(chat_id, file_id, file_name, user_info, file_size=None):
     """Обработка полученного документа/фото"""
-    state = user_states.get(chat_id, "main")
-    
-    # Скачиваем файл
+    state = await state_store.get_user_state(chat_id)
+
+    if state == "manual_mode":
+        # Пересылка менеджеру: файл любого размера идёт потоком из загрузки
+        # сразу в отправку, не накапливаясь в памяти
+        caption = f"📎 Вложение от {user_info}"
+        with metrics.stage("forward"):
+            sent = await send_document(MANAGER_CHAT_ID, iter_file(file_id), file_name, caption)
+        if sent:
+            await send_message(chat_id, "✅ Файл переслан менеджеру.")
+        else:
+            await send_message(chat_id, "❌ Не удалось переслать файл менеджеру.")
+        return
+
+    # Для анализа принимаем файлы не больше MAX_FILE_SIZE
+    max_size = core.MAX_FILE_SIZE
+    if file_size and file_size > max_size:
+        await send_message(chat_id, file_too_large_text())
+        return
+
+    # Скачиваем файл (загрузка прерывается, как только превышен размер)
     try:
-        file_data = get_file(file_id)
+        with metrics.stage("download"):
+            download = await get_file(file_id, max_size=max_size)
+    except FileTooLarge:
+        await send_message(chat_id, file_too_large_text())
+        return
     except Exception as e:
-        logger.error(f"Failed to download file: {e}")
-        send_message(chat_id, "❌ Не удалось скачать файл.")
+        logger.error("Failed to download file: %s", e)
+        await send_message(chat_id, "❌ Не удалось скачать файл.")
         return
-    
-    if state == "manual_mode":
-        # Пересылка менеджеру
-        caption = f"📎 Вложение от {user_info}"
-        send_document(MANAGER_CHAT_ID, file_data, file_name, caption)
-        send_message(chat_id, "✅ Файл переслан менеджеру.")
+    file_data = download.data
+
+    # Тот же файл уже анализировали — отвечаем из кеша без извлечения текста
+    doc_key = cache.document_key(download.sha256)
+    context_key = cache.document_context_key(download.sha256)
+    cached = core.cached_response(doc_key)
+    context = core.cached_response(context_key)
+    if cached is not None and context is not None:
+        await send_message(chat_id, cached)
+        await remember_document(chat_id, file_name, context, cached)
         return
-    
-    send_message(chat_id, "⏳ Анализирую документ...")
-    
+
+    placeholder_id = sent_message_id(await send_message(chat_id, "⏳ Анализирую документ..."))
+
     # Извлечение текста из документа через core
     try:
-        if asyncio.iscoroutinefunction(core.extract_text_from_document):
-            loop = asyncio.new_event_loop()
-            file_text = loop.run_until_complete(core.extract_text_from_document(file_data, file_name))
-            loop.close()
-        else:
-            file_text = core.extract_text_from_document(file_data, file_name)
+        file_text = await core.extract_text_from_document(file_data, file_name, max_chars=analysis.ANALYSIS_MAX_CHARS)
+    except asyncio.TimeoutError:
+        logger.warning("Text extraction timed out for %s", file_name)
+        await send_message(chat_id, "❌ Документ слишком долго обрабатывается. Попробуйте отправить файл меньшего размера.")
+        return
     except Exception as e:
         logger.exception("Error extracting text")
-        send_message(chat_id, "❌ Не удалось извлечь текст из документа.")
+        await send_message(chat_id, "❌ Не удалось извлечь текст из документа.")
         return
-    
+
     if not file_text.strip():
-        send_message(chat_id, "❌ Не удалось извлечь текст.")
+        await send_message(chat_id, "❌ Не удалось извлечь текст.")
         return
-    
-    # Анализ через chat_completion
-    prompt = f"Проанализируй этот документ о закупке: {file_text}"
+
+    # Анализ через chat_completion (длинные документы — через map-reduce);
+    # подготовленный текст сохраняется для последующих вопросов по документу
     try:
-        if asyncio.iscoroutinefunction(core.chat_completion):
-            loop = asyncio.new_event_loop()
-            response = loop.run_until_complete(core.chat_completion(prompt))
-            loop.close()
-        else:
-            response = core.chat_completion(prompt)
-        send_message(chat_id, response)
+        context = await analysis.build_document_context(file_text)
+        core.store_response(context_key, context)
+        answer = await reply_with_completion(chat_id, analysis.document_prompt(context),
+                                             message_id=placeholder_id, cache_key=doc_key, task="document")
+        if answer:
+            await remember_document(chat_id, file_name, context, answer)
     except Exception as e:
         logger.exception("Error in chat_completion for document")
-        send_message(chat_id, "❌ Ошибка при анализе документа.")
+        await send_message(chat_id, "❌ Ошибка при анализе документа.")
+
+async def remember_document(chat_id, file_name, context, answer):
+    """Делает документ и его анализ частью диалога"""
+    await conversation.set_document(state_store, chat_id, file_name, context)
+    await conversation.add_exchange(state_store, chat_id, f"Проанализируй документ «{file_name}».", answer)
 
-def handle_manager_reply(chat_id, text, replied_msg_id):
+async def handle_manager_reply(chat_id, text, replied_msg_id):
     """Ответ менеджера пользователю"""
-    original_user_id = message_to_user_map.pop(replied_msg_id, None)
+    original_user_id = await state_store.pop_forward(replied_msg_id)
     if original_user_id:
-        send_message(original_user_id,
-                     f"💬 <b>Ответ от менеджера:</b>\n\n{text}",
-                     parse_mode="html")
-        send_message(chat_id, "✅ Ответ отправлен пользователю.")
+        await send_message(original_user_id,
+                           f"💬 <b>Ответ от менеджера:</b>\n\n{text}",
+                           parse_mode="html")
+        await send_message(chat_id, "✅ Ответ отправлен пользователю.")
     else:
-        send_message(chat_id, "❌ Не удалось найти пользователя.")
+        await send_message(chat_id, "❌ Не удалось найти пользователя.")
 
-# === Webhook endpoint ===
+# === Обработка обновлений ===
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Главный обработчик входящих обновлений от MAX"""
-    update = request.json
-    logger.info(f"Update received: {json.dumps(update, ensure_ascii=False)}")
-    
+def update_chat_id(update):
+    """chat_id, к которому относится обновление (для сохранения порядка внутри чата)"""
+    if update.get('update_type') == 'new_message':
+        return update.get('message', {}).get('chat', {}).get('chat_id')
+    return update.get('chat_id')
+
+async def check_rate_limit(chat_id, message):
+    """Лимит сообщений на чат и на весь бот; False — сообщение отклонено"""
+    cost = limits.DOCUMENT_COST if 'document' in message or 'photo' in message else 1
+    if not limits.chat_limiter.allow(chat_id, cost):
+        # Предупреждаем один раз за серию, чтобы не отвечать на каждое сообщение флуда
+        if limits.chat_limiter.first_rejection(chat_id):
+            await send_message(chat_id, "⏳ Слишком много сообщений подряд. Пожалуйста, подождите немного.")
+        return False
+    if not limits.global_limiter.allow():
+        logger.warning("Global rate limit exceeded, dropping message from %s", chat_id)
+        if limits.global_limiter.first_rejection():
+            await send_message(chat_id, "⏳ Сервис сейчас перегружен. Пожалуйста, повторите запрос через минуту.")
+        return False
+    return True
+
+async def process_update(update, request_id=None):
+    """Разбор и обработка одного обновления от MAX"""
+    if request_id:
+        metrics.request_id.set(request_id)
+    # Запросы к GigaChat в ходе обработки ставятся в очередь от имени этого чата
+    limits.current_chat.set(update_chat_id(update))
+    update_type = update.get('update_type')
+    metrics.updates.inc(type=update_type)
     try:
-        update_type = update.get('update_type')
-        
-        if update_type == 'bot_started':
-            chat_id = update['chat_id']
-            handle_start(chat_id)
-        
-        elif update_type == 'new_message':
-            message = update['message']
-            chat_id = message['chat']['chat_id']
-            
-            # Информация о пользователе
-            user = message.get('from', {})
-            user_info = f"{user.get('first_name', '')} (@{user.get('username', 'нет')}, ID: {chat_id})"
-            
-            # Текст сообщения
-            text = message.get('text', '')
-            
-            # Проверка на наличие документа/фото
-            if 'document' in message:
-                doc = message['document']
-                file_id = doc['file_id']
-                file_name = doc.get('file_name', 'document')
-                handle_document(chat_id, file_id, file_name, user_info)
-            elif 'photo' in message:
-                # Берём последнее (самое большое) фото
-                photo = message['photo'][-1]
-                file_id = photo['file_id']
-                file_name = 'photo.jpg'
-                handle_document(chat_id, file_id, file_name, user_info)
-            elif text:
-                # Проверка на команды
-                if text == '/start':
-                    handle_start(chat_id)
-                elif text == '/help':
-                    send_message(chat_id, "Справка: ...")
-                elif chat_id == MANAGER_CHAT_ID and message.get('reply_to_message'):
-                    # Ответ менеджера на пересланное сообщение
-                    replied = message['reply_to_message']
-                    replied_msg_id = replied['message_id']
-                    handle_manager_reply(chat_id, text, replied_msg_id)
-                else:
-                    # Обычное текстовое сообщение
-                    handle_text(chat_id, text, user_info)
-            else:
-                logger.warning("Unsupported message type")
-    
+        with metrics.stage("update"):
+            await dispatch_update(update_type, update)
     except Exception as e:
         logger.exception("Error processing update")
-    
-    return jsonify({'ok': True})
 
-@app.route('/', methods=['GET'])
-def index():
-    return "Tender bot is running"
+async def dispatch_update(update_type, update):
+    """Обработка обновления по его типу"""
+    if update_type == 'bot_started':
+        chat_id = update['chat_id']
+        await handle_start(chat_id)
+
+    elif update_type == 'new_message':
+        message = update['message']
+        chat_id = message['chat']['chat_id']
+
+        # Информация о пользователе
+        user = message.get('from', {})
+        user_info = f"{user.get('first_name', '')} (@{user.get('username', 'нет')}, ID: {chat_id})"
+
+        # Текст сообщения
+        text = message.get('text', '')
+
+        if chat_id != MANAGER_CHAT_ID and not await check_rate_limit(chat_id, message):
+            return
+
+        # Проверка на наличие документа/фото
+        if 'document' in message:
+            doc = message['document']
+            file_id = doc['file_id']
+            file_name = doc.get('file_name', 'document')
+            await handle_document(chat_id, file_id, file_name, user_info, doc.get('file_size'))
+        elif 'photo' in message:
+            # Берём последнее (самое большое) фото
+            photo = message['photo'][-1]
+            file_id = photo['file_id']
+            file_name = 'photo.jpg'
+            await handle_document(chat_id, file_id, file_name, user_info, photo.get('file_size'))
+        elif text:
+            # Проверка на команды
+            if text == '/start':
+                await handle_start(chat_id)
+            elif text == '/help':
+                await send_message(chat_id, "Справка: ...")
+            elif chat_id == MANAGER_CHAT_ID and message.get('reply_to_message'):
+                # Ответ менеджера на пересланное сообщение
+                replied = message['reply_to_message']
+                replied_msg_id = replied['message_id']
+                await handle_manager_reply(chat_id, text, replied_msg_id)
+            else:
+                # Обычное текстовое сообщение
+                await handle_text(chat_id, text, user_info)
+        else:
+            logger.warning("Unsupported message type")
+
+# === Фоновая очередь обновлений ===
+# Каждый воркер (asyncio-задача) владеет своей очередью; обновления одного
+# чата всегда попадают к одному воркеру, поэтому порядок внутри чата
+# сохраняется, а разные чаты обрабатываются конкурентно в одном event loop.
+
+class UpdateQueue:
+    def __init__(self, workers, maxsize):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queues = []
+        self.tasks = []
+        self.stats = {
+            'enqueued': 0,
+            'processed': 0,
+            'rejected': 0,
+            'in_progress': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'wait_last': 0.0,
+        }
+
+    def start(self):
+        """Запускает воркеры в текущем event loop"""
+        if self.tasks:
+            return
+        self.queues = [asyncio.Queue(maxsize=self.maxsize) for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self._worker(q), name=f"update-worker-{i}")
+                      for i, q in enumerate(self.queues)]
+        logger.info("Started %d update workers", self.workers)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def put(self, update, request_id=None):
+        """Ставит обновление в очередь; False — очередь переполнена"""
+        chat_id = update_chat_id(update)
+        shard = hash(chat_id) % self.workers
+        try:
+            self.queues[shard].put_nowait((time.monotonic(), request_id, update))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['enqueued'] += 1
+        return True
+
+    async def _worker(self, q):
+        while True:
+            enqueued_at, request_id, update = await q.get()
+            wait = time.monotonic() - enqueued_at
+            metrics.stage_seconds.observe(wait, stage="queue_wait")
+            self.stats['wait_total'] += wait
+            self.stats['wait_last'] = wait
+            self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+            self.stats['in_progress'] += 1
+            try:
+                await process_update(update, request_id)
+            finally:
+                self.stats['in_progress'] -= 1
+                self.stats['processed'] += 1
+                q.task_done()
+
+    def snapshot(self):
+        """Метрики очереди: глубина, время ожидания, счётчики"""
+        stats = dict(self.stats)
+        depths = [q.qsize() for q in self.queues]
+        wait_total = stats.pop('wait_total')
+        stats['wait_avg'] = round(wait_total / stats['processed'], 4) if stats['processed'] else 0.0
+        stats['depth'] = sum(depths)
+        stats['depth_max'] = max(depths, default=0)
+        stats['workers'] = self.workers
+        return stats
+
+update_queue = UpdateQueue(WORKER_COUNT, QUEUE_MAXSIZE)
+
+# === Webhook endpoint ===
+
+async def webhook(request):
+    """Главный обработчик входящих обновлений от MAX"""
+    update = await request.json()
+    request_id = metrics.new_request_id()
+    metrics.request_id.set(request_id)
+    logger.info("Update received: %s", logs.describe_update(update))
+    logs.log_payload(logger, update)
+
+    if INGEST_MODE == 'sync':
+        await process_update(update, request_id)
+        return web.json_response({'ok': True})
+
+    if not update_queue.put(update, request_id):
+        # Очередь переполнена — просим MAX повторить доставку позже
+        logger.warning("Update queue is full, rejecting update")
+        return web.json_response({'ok': False, 'error': 'queue is full'}, status=503)
+    return web.json_response({'ok': True})
+
+async def stats(request):
+    """Состояние очереди обновлений, пулов соединений, токена GigaChat и лимитов"""
+    return web.json_response({
+        'queue': update_queue.snapshot(),
+        'http': http_client.pool_stats(),
+        'token': core.token_manager.snapshot(),
+        'cache': cache.response_cache.snapshot() if cache.response_cache else None,
+        'extract': core.extract_stats,
+        'ocr': dict(ocr.ocr_stats, available=ocr.available()),
+        'state': state_store.snapshot(),
+        'limits': limits.snapshot(),
+        'gigachat_usage': core.usage_snapshot(),
+        'logs': logs.snapshot(),
+        'delivery': {
+            'max_api': max_api_breaker.snapshot(),
+            'gigachat': core.gigachat_breaker.snapshot(),
+            'admin_digest': admin_digest.snapshot(),
+        },
+    })
+
+async def prometheus_metrics(request):
+    """Метрики в текстовом формате Prometheus"""
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+def register_gauges():
+    """Датчики читают текущие снимки состояния при каждом запросе /metrics"""
+    metrics.register_gauge("tenderbot_queue_depth", "Updates waiting in worker queues",
+                           lambda: update_queue.snapshot()['depth'])
+    metrics.register_gauge("tenderbot_updates_in_progress", "Updates being processed",
+                           lambda: update_queue.stats['in_progress'])
+    metrics.register_gauge("tenderbot_cache_entries", "Cached GigaChat responses",
+                           lambda: cache.response_cache.snapshot()['size'])
+    metrics.register_gauge("tenderbot_cache_hit_ratio", "Response cache hit ratio",
+                           lambda: cache.response_cache.snapshot()['hit_ratio'])
+    metrics.register_gauge("tenderbot_gigachat_concurrency", "GigaChat concurrency governor state",
+                           lambda: {k: v for k, v in limits.gigachat.snapshot().items()
+                                    if k in ('limit', 'active', 'waiting')}, label="state")
+    metrics.register_gauge("tenderbot_token_expires_in_seconds", "Seconds until the GigaChat token expires",
+                           lambda: core.token_manager.snapshot()['expires_in'])
+    metrics.register_gauge("tenderbot_circuit_open", "Circuit breakers that are not closed",
+                           lambda: {b.name: int(b.state != 'closed')
+                                    for b in (max_api_breaker, core.gigachat_breaker)}, label="service")
+
+async def index(request):
+    return web.Response(text="Tender bot is running")
+
+# === Жизненный цикл приложения ===
+
+async def on_startup(app):
+    await state_store.start()
+    if cache.response_cache is not None:
+        await cache.response_cache.start()
+    update_queue.start()
+    admin_digest.start()
+    # Токен GigaChat обновляется в фоне, вне пути ответа пользователю
+    core.token_manager.start()
+    # Проверка tesseract — один раз при запуске, а не на первом скане
+    ocr.available()
+
+async def on_cleanup(app):
+    await update_queue.stop()
+    await admin_digest.stop()
+    await state_store.close()
+    if cache.response_cache is not None:
+        await cache.response_cache.close()
+    await core.token_manager.stop()
+    core.shutdown_extract_pool()
+    ocr.shutdown_pool()
+    await http_client.close_session()
+
+def create_app():
+    app = web.Application()
+    app.router.add_post('/webhook', webhook)
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/metrics', prometheus_metrics)
+    app.router.add_get('/', index)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+register_gauges()
+app = create_app()
 
-# === Для локального тестирования (необязательно) ===
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    web.run_app(app, host='0.0.0.0', port=port)
@@ -0,0 +1,184 @@
+# cache.py
+# Кеш ответов GigaChat: повторяющиеся вопросы и одинаковые документы
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") == "1"
+CACHE_TTL = int(os.getenv("CACHE_TTL", 24 * 3600))            # сек.
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1000))
+CACHE_PATH = os.getenv("CACHE_PATH", "")                      # SQLite-файл; пусто — только память
+CACHE_FLUSH_INTERVAL = float(os.getenv("CACHE_FLUSH_INTERVAL", 1))  # сек. между записями на диск
+
+logger = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(text: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, ё, пунктуация, пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+def text_key(text: str) -> str:
+    return "text:" + hashlib.sha256(normalize_prompt(text).encode()).hexdigest()
+
+def document_key(sha256: str) -> str:
+    """Ключ анализа документа по SHA-256 его содержимого (считается при скачивании)"""
+    return "doc:" + sha256
+
+def document_context_key(sha256: str) -> str:
+    """Ключ подготовленного текста документа (для вопросов по нему без повторного разбора)"""
+    return "ctx:" + sha256
+
+class ResponseCache:
+    """LRU-кеш с TTL в памяти и необязательной копией на диске (SQLite)
+
+    Запись на диск идёт пакетами раз в CACHE_FLUSH_INTERVAL в отдельном
+    потоке и через своё соединение: commit с fsync не задерживает event loop
+    и чтение с диска (поиск по первичному ключу).
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, path=CACHE_PATH,
+                 flush_interval=CACHE_FLUSH_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires_at, value)
+        self._db = None
+        self._writer = None             # соединение потока записи
+        self.path = path
+        self._pending = {}              # key -> (expires_at, value), ещё не записанные
+        self._touched = {}              # key -> used_at для найденных на диске
+        self._flush_interval = flush_interval
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.stats = {"hits": 0, "misses": 0, "disk_hits": 0, "stores": 0, "evictions": 0, "flushes": 0}
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return value
+            del self._entries[key]
+
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] > now:
+            self._remember(key, *pending)
+            self.stats["hits"] += 1
+            return pending[1]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row:
+                self._touched[key] = now
+                self._remember(key, row[1], row[0])
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return row[0]
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, value)
+        self.stats["stores"] += 1
+        if self._db is not None:
+            self._pending[key] = (expires_at, value)
+            self._touched.pop(key, None)
+
+    async def start(self):
+        if self._db is not None and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="cache-flush")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией в отдельном потоке"""
+        if self._db is None or not (self._pending or self._touched):
+            return
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            touched, self._touched = self._touched, {}
+            try:
+                await asyncio.to_thread(self._write, pending, touched)
+            except Exception:
+                logger.exception("Cache flush failed")
+                for k, v in pending.items():
+                    self._pending.setdefault(k, v)
+                return
+            self.stats["flushes"] += 1
+
+    def _write(self, pending, touched):
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, check_same_thread=False)
+        db = self._writer
+        now = time.time()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                [(key, value, expires_at, now) for key, (expires_at, value) in pending.items()],
+            )
+            db.executemany("UPDATE responses SET used_at = ? WHERE key = ?",
+                           [(used_at, key) for key, used_at in touched.items()])
+            # Размер на диске ограничен тем же числом записей, вытесняем давно не использованные
+            db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    def _remember(self, key, expires_at, value):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["size"] = len(self._entries)
+        stats["disk"] = self._db is not None
+        stats["pending"] = len(self._pending)
+        return stats
+
+response_cache = ResponseCache() if CACHE_ENABLED else None
@@ -0,0 +1,110 @@
+# conversation.py
+# Память диалога: последние реплики, краткое содержание более старых и текст
+# последнего документа. Хранится в общем хранилище состояний (state.py), поэтому
+# доступна любому процессу бота.
+import os
+import logging
+import core
+import analysis
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", 8))      # реплик хранится дословно
+HISTORY_TOKENS = int(os.getenv("HISTORY_TOKENS", 4000))               # бюджет контекста на запрос
+SUMMARY_MAX_CHARS = 1500
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", 24 * 3600))
+
+CONVERSATION = "conversation"
+
+SUMMARY_SYSTEM_PROMPT = """Сожми переписку консультанта по госзакупкам с клиентом в краткое содержание.
+Сохрани: о какой закупке или документе шла речь, ключевые цифры и условия, вопросы клиента и данные ему ответы.
+Пиши кратко, не более 10 пунктов, без приветствий и контактов."""
+
+# Сжатие переписки не требует Pro; ответ ограничен SUMMARY_MAX_CHARS
+core.register_task("summary", SUMMARY_SYSTEM_PROMPT, model=core.GIGACHAT_LITE_MODEL,
+                   max_tokens=SUMMARY_MAX_CHARS // core.CHARS_PER_TOKEN, temperature=0.3)
+
+def _empty():
+    return {"summary": "", "messages": [], "document": None}
+
+async def load(store, chat_id) -> dict:
+    return await store.get(CONVERSATION, chat_id) or _empty()
+
+async def save(store, chat_id, record):
+    await store.set(CONVERSATION, chat_id, record, CONVERSATION_TTL)
+
+async def reset(store, chat_id):
+    await store.pop(CONVERSATION, chat_id)
+
+async def set_document(store, chat_id, file_name, context):
+    """Запоминает материал документа для последующих вопросов по нему"""
+    record = await load(store, chat_id)
+    record["document"] = {"name": file_name, "text": context[:core.EXTRACT_MAX_CHARS]}
+    await save(store, chat_id, record)
+
+async def build_history(store, chat_id) -> list:
+    """Сообщения для GigaChat перед текущим вопросом, в пределах HISTORY_TOKENS
+
+    Порядок: документ, краткое содержание старой части диалога, последние
+    реплики (сколько помещается в бюджет, начиная с самых свежих).
+    """
+    record = await load(store, chat_id)
+    budget = HISTORY_TOKENS
+    prefix = []
+
+    document = record.get("document")
+    if document:
+        content = f"Документ «{document['name']}», который клиент прислал ранее:\n{document['text']}"
+        prefix.append({"role": "user", "content": content})
+        prefix.append({"role": "assistant", "content": "Документ получен, готов отвечать на вопросы по нему."})
+        budget -= analysis.estimate_tokens(content)
+
+    if record.get("summary"):
+        content = f"Краткое содержание предыдущей переписки:\n{record['summary']}"
+        prefix.append({"role": "user", "content": content})
+        prefix.append({"role": "assistant", "content": "Понял, учту."})
+        budget -= analysis.estimate_tokens(content)
+
+    recent = []
+    for role, content in reversed(record.get("messages", [])):
+        cost = analysis.estimate_tokens(content)
+        if cost > budget:
+            break
+        recent.append({"role": role, "content": content})
+        budget -= cost
+    recent.reverse()
+    # GigaChat ожидает, что реплика ассистента идёт после вопроса пользователя
+    while recent and recent[0]["role"] != "user":
+        recent.pop(0)
+    return prefix + recent
+
+async def add_exchange(store, chat_id, question, answer):
+    """Добавляет вопрос и ответ; старые реплики сворачиваются в краткое содержание"""
+    record = await load(store, chat_id)
+    messages = record.get("messages", [])
+    messages.append(["user", question])
+    messages.append(["assistant", answer])
+
+    if len(messages) > HISTORY_MAX_MESSAGES:
+        overflow = messages[:-HISTORY_MAX_MESSAGES]
+        messages = messages[-HISTORY_MAX_MESSAGES:]
+        record["summary"] = await _summarize(record.get("summary", ""), overflow)
+
+    record["messages"] = messages
+    await save(store, chat_id, record)
+
+async def _summarize(summary, messages) -> str:
+    lines = [f"Предыдущее краткое содержание:\n{summary}"] if summary else []
+    for role, content in messages:
+        who = "Клиент" if role == "user" else "Консультант"
+        lines.append(f"{who}: {content}")
+    try:
+        result = await core.request_completion(
+            "\n\n".join(lines)[:core.EXTRACT_MAX_CHARS],
+            task="summary",
+        )
+    except core.GigaChatError as e:
+        # Без модели просто оставляем начало прежнего содержания
+        logger.warning("Conversation summary failed: %s", e)
+        return summary
+    return result.strip()[:SUMMARY_MAX_CHARS]
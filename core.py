@@ -3,69 +3,188 @@ import os
 import base64
 import uuid
 import time
-import tempfile
-from aiohttp import ClientSession
+import json
+import asyncio
+import io
+import logging
+import multiprocessing
+import aiohttp
 from PyPDF2 import PdfReader
 import docx
+import http_client
+import cache
+import limits
+import delivery
+import metrics
+import ocr
+
+logger = logging.getLogger(__name__)
 
 # === Чтение переменных окружения ===
 GIGACHAT_CLIENT_ID = os.getenv("GIGACHAT_CLIENT_ID")
 GIGACHAT_CLIENT_SECRET = os.getenv("GIGACHAT_CLIENT_SECRET")
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 5 * 1024 * 1024))  # 5 MB
 
 # === GigaChat API ===
-TOKEN_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-CHAT_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+# Адреса можно переопределить (например, на локальные заглушки из bench/)
+TOKEN_URL = os.getenv("GIGACHAT_TOKEN_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+CHAT_URL = os.getenv("GIGACHAT_CHAT_URL", "https://gigachat.devices.sberbank.ru/api/v1/chat/completions")
 SCOPE = "GIGACHAT_API_PERS"
-_token_cache = {"access_token": None, "expires_at": 0}
+CHAT_TIMEOUT = aiohttp.ClientTimeout(total=30)
+# При потоковой выдаче ограничиваем паузу между фрагментами, а не всю генерацию
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_read=30)
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 120))  # обновлять за N сек. до истечения
+TOKEN_RETRY_DELAY = int(os.getenv("TOKEN_RETRY_DELAY", 10))         # пауза после неудачного обновления
+TOKEN_MAX_RETRIES = int(os.getenv("TOKEN_MAX_RETRIES", 1))          # повторов запроса при 401
+OVERLOAD_MAX_RETRIES = int(os.getenv("OVERLOAD_MAX_RETRIES", 2))    # повторов при 429/5xx
+
+# === Модели GigaChat ===
+# Короткие вопросы без длинного контекста отвечает лёгкая модель (быстрее и
+# дешевле), анализ документов и вопросы по ним — Pro
+GIGACHAT_MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat-Pro")
+GIGACHAT_LITE_MODEL = os.getenv("GIGACHAT_LITE_MODEL", "GigaChat")
+LITE_MAX_CHARS = int(os.getenv("LITE_MAX_CHARS", 300))                  # вопрос длиннее — Pro (0 — всегда Pro)
+LITE_MAX_CONTEXT_CHARS = int(os.getenv("LITE_MAX_CONTEXT_CHARS", 3000)) # история длиннее (документ) — Pro
+ANSWER_MAX_TOKENS = int(os.getenv("ANSWER_MAX_TOKENS", 1000))          # ответ Pro
+LITE_MAX_TOKENS = int(os.getenv("LITE_MAX_TOKENS", 600))               # ответ лёгкой модели
+# Модели отдельных задач поверх значений по умолчанию, например "map=GigaChat,summary=GigaChat-Pro"
+TASK_MODELS = dict(item.split("=", 1) for item in os.getenv("TASK_MODELS", "").replace(" ", "").split(",")
+                   if "=" in item)
+CHARS_PER_TOKEN = 3   # оценка расхода, если GigaChat не вернул usage
 
 def _encode_auth_key(client_id, client_secret):
     return base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
 
-async def get_access_token():
-    """Получение токена GigaChat (с кешированием)"""
-    now = time.time()
-    if _token_cache["access_token"] and _token_cache["expires_at"] > now + 10:
-        return _token_cache["access_token"]
-
-    auth_key = _encode_auth_key(GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET)
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {auth_key}",
-    }
-    data = {"scope": SCOPE}
-
-    async with ClientSession() as session:
+class TokenManager:
+    """Токен GigaChat: одно обновление на всех, фоновое обновление до истечения"""
+
+    def __init__(self):
+        self.access_token = None
+        self.expires_at = 0
+        self._refreshing = None   # asyncio.Task текущего обновления
+        self._task = None         # фоновая задача обновления
+        self.stats = {
+            "refreshes": 0,
+            "failures": 0,
+            "invalidations": 0,
+            "last_latency": 0.0,
+            "max_latency": 0.0,
+            "last_error": None,
+        }
+
+    def valid(self) -> bool:
+        return bool(self.access_token) and self.expires_at > time.time() + 10
+
+    async def get(self):
+        """Текущий токен; при необходимости ждёт единственного обновления"""
+        if self.valid():
+            return self.access_token
+        return await self.refresh()
+
+    async def refresh(self):
+        """Обновление токена; параллельные вызовы ждут один и тот же запрос"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(self._refreshing)
+
+    def invalidate(self, token):
+        """Сбрасывает токен, отвергнутый сервером (если его ещё не заменили)"""
+        if token and token == self.access_token:
+            self.access_token = None
+            self.expires_at = 0
+            self.stats["invalidations"] += 1
+
+    async def _fetch(self):
+        auth_key = _encode_auth_key(GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET)
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4()),
+            "Authorization": f"Basic {auth_key}",
+        }
+        data = {"scope": SCOPE}
+
+        started = time.monotonic()
+        session = http_client.get_session()
         try:
             async with session.post(TOKEN_URL, headers=headers, data=data, ssl=False) as resp:
                 if resp.status != 200:
-                    return None
+                    metrics.http_error("gigachat_oauth", resp.status)
+                    return self._failed(f"HTTP {resp.status}")
                 js = await resp.json()
-                token = js.get("access_token")
-                if not token:
-                    return None
-                _token_cache["access_token"] = token
-                _token_cache["expires_at"] = now + js.get("expires_in", 3600)
-                return token
-        except Exception:
-            return None
-
-async def chat_completion(message_text: str) -> str:
-    """Отправка запроса в GigaChat и получение ответа"""
-    token = await get_access_token()
-    if not token:
-        return "Извините, сервис временно недоступен. Пожалуйста, попробуйте позже или свяжитесь с менеджером."
+        except Exception as e:
+            metrics.stage_errors.inc(stage="token")
+            return self._failed(repr(e))
+        finally:
+            latency = time.monotonic() - started
+            metrics.stage_seconds.observe(latency, stage="token")
+            self.stats["last_latency"] = round(latency, 4)
+            self.stats["max_latency"] = round(max(self.stats["max_latency"], latency), 4)
+
+        token = js.get("access_token")
+        if not token:
+            return self._failed("no access_token in response")
+        self.access_token = token
+        if js.get("expires_at"):
+            # GigaChat отдаёт expires_at в миллисекундах
+            self.expires_at = js["expires_at"] / 1000
+        else:
+            self.expires_at = time.time() + js.get("expires_in", 3600)
+        self.stats["refreshes"] += 1
+        self.stats["last_error"] = None
+        return token
+
+    def _failed(self, error):
+        self.stats["failures"] += 1
+        self.stats["last_error"] = error
+        return None
+
+    def start(self):
+        """Запускает фоновое обновление токена в текущем event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh_loop(), name="gigachat-token-refresh")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            if self.valid():
+                delay = self.expires_at - time.time() - TOKEN_REFRESH_MARGIN
+            else:
+                delay = 0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            token = await self.refresh()
+            if not token:
+                await asyncio.sleep(TOKEN_RETRY_DELAY)
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["valid"] = self.valid()
+        stats["expires_in"] = max(0, round(self.expires_at - time.time())) if self.access_token else 0
+        return stats
+
+token_manager = TokenManager()
+
+async def get_access_token():
+    """Получение токена GigaChat (с кешированием)"""
+    return await token_manager.get()
+
+SERVICE_UNAVAILABLE = "Извините, сервис временно недоступен. Пожалуйста, попробуйте позже или свяжитесь с менеджером."
 
-    headers = {
+def _auth_headers(token, accept="application/json"):
+    return {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
-        "Accept": "application/json"
+        "Accept": accept,
     }
-    
-    # ========== СИСТЕМНЫЙ ПРОМПТ (ВАШ ОРИГИНАЛЬНЫЙ) ==========
-    system_prompt = """Ты — виртуальный Тендерный специалист компании ООО "Тритика".
+
+# ========== СИСТЕМНЫЙ ПРОМПТ (ВАШ ОРИГИНАЛЬНЫЙ) ==========
+SYSTEM_PROMPT = """Ты — виртуальный Тендерный специалист компании ООО "Тритика".
 Твоя основная задача — профессионально консультировать клиентов по участию в закупках и мотивировать их воспользоваться услугами компании.
 📌 Основные обязанности:
 1. Отвечай на вопросы по 44-ФЗ, 223-ФЗ, коммерческим закупкам, электронным торгам.
@@ -110,33 +229,298 @@ async def chat_completion(message_text: str) -> str:
 📍 Адрес: г. Владимир, ул. Разина, д. 51, 3 этаж
 📞 Телефон: +7(4922)223-222, +7(904)6536987
 📧 E-mail: info@tritika.ru"""
-    
-    data = {
-        "model": "GigaChat-Pro",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": message_text},
-        ],
-        "temperature": 0.5,
-        "max_tokens": 1000,
-    }
 
-    async with ClientSession() as session:
-        try:
-            async with session.post(CHAT_URL, headers=headers, json=data, ssl=False, timeout=30) as resp:
-                if resp.status == 200:
-                    js = await resp.json()
-                    if "choices" in js and len(js["choices"]) > 0:
-                        return js["choices"][0]["message"]["content"]
-                elif resp.status == 401:
-                    _token_cache["access_token"] = None
-                    return await chat_completion(message_text)
-                else:
-                    return f"Ошибка сервиса (код {resp.status}). Попробуйте позже."
-        except asyncio.TimeoutError:
-            return "Таймаут при обращении к сервису. Попробуйте позже."
-        except Exception as e:
-            return "Внутренняя ошибка сервиса."
+# Сокращённый промпт для лёгкой модели: короткий вопрос не требует всей
+# инструкции по анализу документов, а каждый её символ оплачивается в каждом запросе
+SYSTEM_PROMPT_LITE = """Ты — тендерный специалист компании ООО "Тритика" (44-ФЗ, 223-ФЗ, коммерческие закупки, ЭТП, ЭЦП, банковские гарантии).
+Отвечай точно, кратко и по делу, со списками и **жирными** акцентами. Ничего не придумывай.
+В конце предложи помощь ООО "Тритика": +7(4922)223-222, info@tritika.ru."""
+
+class Task:
+    """Тип запроса к GigaChat: модель, параметры генерации и системное сообщение
+
+    Системные сообщения собираются один раз при регистрации задачи. Если задан
+    lite_prompt, короткие вопросы с небольшой историей уходят лёгкой модели
+    с этим промптом.
+    """
+
+    def __init__(self, name, system_prompt, model=None, max_tokens=ANSWER_MAX_TOKENS, temperature=0.5,
+                 lite_prompt=None, lite_max_tokens=LITE_MAX_TOKENS):
+        self.name = name
+        self.model = TASK_MODELS.get(name, model or GIGACHAT_MODEL)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.lite_message = {"role": "system", "content": lite_prompt} if lite_prompt else None
+        self.lite_max_tokens = lite_max_tokens
+
+    def use_lite(self, message_text: str, history: list = None) -> bool:
+        if self.lite_message is None or len(message_text) > LITE_MAX_CHARS:
+            return False
+        return sum(len(m["content"]) for m in history or ()) <= LITE_MAX_CONTEXT_CHARS
+
+    def build(self, message_text: str, stream: bool = False, history: list = None) -> dict:
+        if self.use_lite(message_text, history):
+            model, system_message, max_tokens = GIGACHAT_LITE_MODEL, self.lite_message, self.lite_max_tokens
+        else:
+            model, system_message, max_tokens = self.model, self.system_message, self.max_tokens
+        data = {
+            "model": model,
+            "messages": [system_message, *(history or []), {"role": "user", "content": message_text}],
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+        }
+        if stream:
+            data["stream"] = True
+        return data
+
+TASKS = {}
+
+def register_task(name, system_prompt, **kwargs) -> Task:
+    """Регистрирует тип запроса (модули с собственными промптами — при импорте)"""
+    TASKS[name] = Task(name, system_prompt, **kwargs)
+    return TASKS[name]
+
+# Вопросы клиента: короткие — лёгкой модели; анализ документа — всегда Pro
+register_task("chat", SYSTEM_PROMPT, lite_prompt=SYSTEM_PROMPT_LITE)
+register_task("document", SYSTEM_PROMPT)
+
+def _build_request(message_text: str, stream: bool = False, task: str = "chat", history: list = None) -> dict:
+    """Тело запроса к GigaChat
+
+    task — тип запроса (TASKS): модель, лимит ответа и системный промпт;
+    history — предыдущие сообщения диалога ({"role", "content"}) перед текущим.
+    """
+    return TASKS[task].build(message_text, stream=stream, history=history)
+
+# Расход токенов по задачам и моделям: (задача, модель) -> счётчики
+usage_stats = {}
+
+def record_usage(task: str, data: dict, usage: dict = None, answer: str = ""):
+    """Учёт токенов одного запроса: из поля usage ответа GigaChat, иначе оценка по длине"""
+    if usage:
+        prompt = usage.get("prompt_tokens", 0)
+        completion = usage.get("completion_tokens", 0)
+        precached = usage.get("precached_prompt_tokens", 0)
+    else:
+        prompt = sum(len(m["content"]) for m in data["messages"]) // CHARS_PER_TOKEN + 1
+        completion = len(answer) // CHARS_PER_TOKEN + 1
+        precached = 0
+    model = data["model"]
+    entry = usage_stats.setdefault(f"{task}/{model}", {
+        "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "precached_tokens": 0, "estimated": 0,
+    })
+    entry["requests"] += 1
+    entry["prompt_tokens"] += prompt
+    entry["completion_tokens"] += completion
+    entry["precached_tokens"] += precached
+    if not usage:
+        entry["estimated"] += 1
+    metrics.gigachat_tokens.inc(prompt, task=task, model=model, kind="prompt")
+    metrics.gigachat_tokens.inc(completion, task=task, model=model, kind="completion")
+    logger.debug("GigaChat %s/%s: prompt=%d completion=%d tokens%s",
+                 task, model, prompt, completion, "" if usage else " (estimated)")
+
+def usage_snapshot() -> dict:
+    return {key: dict(entry) for key, entry in usage_stats.items()}
+
+
+def cached_response(cache_key):
+    """Готовый ответ из кеша (или None)"""
+    if cache.response_cache is None or cache_key is None:
+        return None
+    return cache.response_cache.get(cache_key)
+
+def store_response(cache_key, text):
+    if cache.response_cache is not None and cache_key is not None:
+        cache.response_cache.set(cache_key, text)
+
+class GigaChatError(Exception):
+    """Ошибка обращения к GigaChat; текст исключения можно показать пользователю"""
+
+# Серия перегрузок и таймаутов GigaChat размыкает цепь: пользователи сразу
+# получают SERVICE_UNAVAILABLE, а не ждут таймаута каждого запроса
+gigachat_breaker = delivery.CircuitBreaker("gigachat")
+
+def _check_breaker():
+    if not gigachat_breaker.allow():
+        raise GigaChatError(SERVICE_UNAVAILABLE)
+
+def _default_cache_key(message_text: str, task: str) -> str:
+    # Ответы вопросов клиента кешируются по тексту, остальных задач — с её именем
+    return cache.text_key(message_text if task == "chat" else f"{task}: {message_text}")
+
+async def request_completion(message_text: str, cache_key: str = None, task: str = "chat",
+                             history: list = None) -> str:
+    """Запрос к GigaChat; при ошибке выбрасывает GigaChatError
+
+    task — тип запроса (TASKS); cache_key — ключ кеша ответа, по умолчанию —
+    нормализованный текст запроса (ответы с историей диалога по умолчанию не кешируются).
+    """
+    if cache_key is None and not history:
+        cache_key = _default_cache_key(message_text, task)
+    cached = cached_response(cache_key)
+    if cached is not None:
+        return cached
+
+    _check_breaker()
+    token = await get_access_token()
+    if not token:
+        raise GigaChatError(SERVICE_UNAVAILABLE)
+
+    headers = _auth_headers(token)
+    data = _build_request(message_text, task=task, history=history)
+
+    session = http_client.get_session()
+    with metrics.stage("completion"):
+        auth_retries = 0
+        for attempt in range(TOKEN_MAX_RETRIES + OVERLOAD_MAX_RETRIES + 1):
+            try:
+                # Число одновременных запросов ограничено общим адаптивным лимитом
+                async with limits.gigachat.slot():
+                    async with session.post(CHAT_URL, headers=headers, json=data, ssl=False, timeout=CHAT_TIMEOUT) as resp:
+                        if resp.status != 200:
+                            metrics.http_error("gigachat", resp.status)
+                        if resp.status == 200:
+                            js = await resp.json()
+                            limits.gigachat.succeeded()
+                            gigachat_breaker.success()
+                            if "choices" in js and len(js["choices"]) > 0:
+                                answer = js["choices"][0]["message"]["content"]
+                                record_usage(task, data, js.get("usage"), answer)
+                                store_response(cache_key, answer)
+                                return answer
+                            raise GigaChatError("Внутренняя ошибка сервиса.")
+                        elif resp.status == 401:
+                            # Токен отозван раньше срока — обновляем и повторяем не больше TOKEN_MAX_RETRIES раз
+                            auth_retries += 1
+                            if auth_retries > TOKEN_MAX_RETRIES:
+                                raise GigaChatError(SERVICE_UNAVAILABLE)
+                            token_manager.invalidate(token)
+                            token = await get_access_token()
+                            if not token:
+                                break
+                            headers = _auth_headers(token)
+                        elif resp.status in limits.OVERLOAD_STATUSES:
+                            # Сервис перегружен — снижаем лимит и повторяем после паузы;
+                            # 429 — ограничение частоты, а не отказ: выключателю не засчитывается
+                            limits.gigachat.overloaded(limits.retry_after(resp.headers))
+                            if resp.status != 429:
+                                gigachat_breaker.failure()
+                                _check_breaker()
+                        else:
+                            raise GigaChatError(f"Ошибка сервиса (код {resp.status}). Попробуйте позже.")
+            except GigaChatError:
+                raise
+            except asyncio.TimeoutError:
+                metrics.http_error("gigachat", "timeout")
+                limits.gigachat.overloaded()
+                gigachat_breaker.failure()
+                raise GigaChatError("Таймаут при обращении к сервису. Попробуйте позже.")
+            except Exception as e:
+                gigachat_breaker.failure()
+                raise GigaChatError("Внутренняя ошибка сервиса.") from e
+        raise GigaChatError(SERVICE_UNAVAILABLE)
+
+async def chat_completion(message_text: str, cache_key: str = None) -> str:
+    """Отправка запроса в GigaChat и получение ответа (текст ошибки — тоже ответ)"""
+    try:
+        return await request_completion(message_text, cache_key=cache_key)
+    except GigaChatError as e:
+        return str(e)
+
+async def chat_completion_stream(message_text: str, cache_key: str = None, history: list = None,
+                                 task: str = "chat"):
+    """Потоковый ответ GigaChat (SSE): выдаёт фрагменты текста по мере генерации
+
+    При ошибке выбрасывает GigaChatError (возможно, после части фрагментов).
+    """
+    if cache_key is None and not history:
+        cache_key = _default_cache_key(message_text, task)
+    cached = cached_response(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    _check_breaker()
+    token = await get_access_token()
+    if not token:
+        raise GigaChatError(SERVICE_UNAVAILABLE)
+
+    headers = _auth_headers(token, accept="text/event-stream")
+    data = _build_request(message_text, stream=True, task=task, history=history)
+    started = time.monotonic()
+
+    session = http_client.get_session()
+    with metrics.stage("completion"):
+        auth_retries = 0
+        for attempt in range(TOKEN_MAX_RETRIES + OVERLOAD_MAX_RETRIES + 1):
+            try:
+                # Слот занят, пока идёт генерация ответа
+                async with limits.gigachat.slot():
+                    async with session.post(CHAT_URL, headers=headers, json=data, ssl=False, timeout=STREAM_TIMEOUT) as resp:
+                        if resp.status != 200:
+                            metrics.http_error("gigachat", resp.status)
+                        if resp.status == 401:
+                            auth_retries += 1
+                            if auth_retries > TOKEN_MAX_RETRIES:
+                                raise GigaChatError(SERVICE_UNAVAILABLE)
+                            token_manager.invalidate(token)
+                            token = await get_access_token()
+                            if not token:
+                                break
+                            headers = _auth_headers(token, accept="text/event-stream")
+                            continue
+                        if resp.status in limits.OVERLOAD_STATUSES:
+                            limits.gigachat.overloaded(limits.retry_after(resp.headers))
+                            if resp.status != 429:
+                                gigachat_breaker.failure()
+                                _check_breaker()
+                            continue
+                        if resp.status != 200:
+                            raise GigaChatError(f"Ошибка сервиса (код {resp.status}). Попробуйте позже.")
+                        parts = []
+                        usage = None
+                        async for raw in resp.content:
+                            line = raw.decode("utf-8", errors="ignore").strip()
+                            if not line.startswith("data:"):
+                                continue
+                            payload = line[5:].strip()
+                            if payload == "[DONE]":
+                                break
+                            try:
+                                js = json.loads(payload)
+                            except ValueError:
+                                continue
+                            # Расход токенов приходит в последнем фрагменте
+                            usage = js.get("usage") or usage
+                            for choice in js.get("choices", []):
+                                delta = choice.get("delta", {}).get("content")
+                                if delta:
+                                    if not parts:
+                                        metrics.stage_seconds.observe(time.monotonic() - started,
+                                                                      stage="completion_first_chunk")
+                                    parts.append(delta)
+                                    yield delta
+                        if not parts:
+                            raise GigaChatError("Внутренняя ошибка сервиса.")
+                        limits.gigachat.succeeded()
+                        gigachat_breaker.success()
+                        answer = "".join(parts)
+                        record_usage(task, data, usage, answer)
+                        store_response(cache_key, answer)
+                        return
+            except GigaChatError:
+                raise
+            except asyncio.TimeoutError:
+                metrics.http_error("gigachat", "timeout")
+                limits.gigachat.overloaded()
+                gigachat_breaker.failure()
+                raise GigaChatError("Таймаут при обращении к сервису. Попробуйте позже.")
+            except Exception as e:
+                gigachat_breaker.failure()
+                raise GigaChatError("Внутренняя ошибка сервиса.") from e
+        raise GigaChatError(SERVICE_UNAVAILABLE)
 
 # ========== ПРАЙС-ЛИСТЫ ==========
 def get_price_list() -> str:
@@ -249,28 +633,210 @@ def get_ecp_price() -> str:
 """
 
 # ========== ОБРАБОТКА ДОКУМЕНТОВ ==========
-async def extract_text_from_document(file_bytes: bytes, filename: str) -> str:
-    """Извлекает текст из PDF, DOCX или TXT файла (до 8000 символов)"""
-    suffix = os.path.splitext(filename)[1].lower()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(file_bytes)
-        tmp_path = tmp.name
-
+# Разбор PDF/DOCX выполняется в отдельных процессах: тяжёлый файл не блокирует
+# event loop и не задерживает ответы другим пользователям. Каждый документ
+# разбирается в своём процессе, поэтому зависший файл завершается по таймауту
+# один, не прерывая разбор чужих документов.
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 2))   # одновременных разборов
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", 60))        # сек. на один документ
+EXTRACT_MEMORY_MB = int(os.getenv("EXTRACT_MEMORY_MB", 1024))    # лимит памяти процесса-обработчика
+EXTRACT_MAX_CHARS = 8000                                           # бюджет текста для GigaChat
+
+_extract_context = None
+_extract_slots = None
+_extract_processes = set()
+extract_stats = {"jobs": 0, "failures": 0, "timeouts": 0, "killed": 0, "seconds_total": 0.0, "seconds_max": 0.0}
+
+class ExtractCrashed(Exception):
+    """Процесс разбора завершился, не вернув результат (например, из-за лимита памяти)"""
+
+def _address_space() -> int:
+    """Текущий размер адресного пространства процесса, байт (0 — неизвестен)"""
     try:
-        if filename.lower().endswith('.pdf'):
-            reader = PdfReader(tmp_path)
-            text = "\n".join([page.extract_text() or "" for page in reader.pages])
-        elif filename.lower().endswith('.docx'):
-            doc = docx.Document(tmp_path)
-            text = "\n".join([p.text for p in doc.paragraphs])
-        else:  # пробуем как текстовый файл
-            try:
-                with open(tmp_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    text = f.read()
-            except:
-                with open(tmp_path, 'r', encoding='cp1251', errors='ignore') as f:
-                    text = f.read()
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def _limit_worker_memory():
+    """Ограничение памяти процесса-обработчика (только Unix)
+
+    Процесс получен fork() от бота и уже занимает его адресное пространство
+    (приложение, стеки потоков, арены malloc), поэтому EXTRACT_MEMORY_MB
+    отсчитывается от текущего размера, а не от нуля.
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = _address_space() + EXTRACT_MEMORY_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _get_extract_context():
+    """fork, где он есть: процесс стартует быстро и не импортирует главный модуль бота заново"""
+    global _extract_context
+    if _extract_context is None:
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        _extract_context = multiprocessing.get_context(method)
+    return _extract_context
+
+def _extract_job(conn, args):
+    """Точка входа процесса разбора: результат или исключение уходят в conn"""
+    # Очередь журнала унаследована от бота вместе с её блокировками, а поток,
+    # который её разбирает, остался в родителе, — пишем напрямую в stderr
+    logging.getLogger().handlers[:] = [logging.StreamHandler()]
+    _limit_worker_memory()
+    try:
+        result = (True, _extract_parts_sync(*args))
+    except Exception as e:
+        result = (False, e)
+    try:
+        conn.send(result)
+    except Exception as e:
+        # Исключение не сериализуется — передаём его описание
+        conn.send((False, RuntimeError(repr(e))))
+    finally:
+        conn.close()
+
+async def _run_in_process(args, timeout):
+    """Выполняет _extract_parts_sync(*args) в отдельном процессе; по таймауту процесс завершается"""
+    ctx = _get_extract_context()
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_extract_job, args=(sender, args), daemon=True)
+    loop = asyncio.get_running_loop()
+    process.start()
+    sender.close()
+    _extract_processes.add(process)
+    received = False
+    try:
+        try:
+            ok, result = await asyncio.wait_for(loop.run_in_executor(None, receiver.recv), timeout)
+        except EOFError:
+            raise ExtractCrashed(f"exit code {process.exitcode}") from None
+        received = True
+        if not ok:
+            raise result
+        return result
+    finally:
+        if not received and process.is_alive():
+            # Таймаут или отмена; ожидающий recv() в потоке получит EOFError
+            process.terminate()
+            extract_stats["killed"] += 1
+        await loop.run_in_executor(None, process.join, 5)
+        _extract_processes.discard(process)
+        receiver.close()
+
+def shutdown_extract_pool():
+    """Завершает процессы разбора, ещё работающие при остановке бота"""
+    for process in list(_extract_processes):
+        if process.is_alive():
+            process.terminate()
+    _extract_processes.clear()
+
+def _decode_text(data: bytes) -> str:
+    """Текстовый файл: UTF-8, иначе cp1251"""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Обрезанный на границе символ в конце — не повод менять кодировку
+        if e.start >= len(data) - 3:
+            return data[:e.start].decode('utf-8', errors='ignore')
+        return data.decode('cp1251', errors='ignore')
+
+def _page_images(page) -> list:
+    """Изображения страницы PDF (для распознавания скана)"""
+    try:
+        return [image.data for image in page.images]
+    except Exception:
+        return []
+
+def _extract_parts_sync(file_bytes: bytes, filename: str, max_chars: int = EXTRACT_MAX_CHARS,
+                        ocr_pages: int = 0) -> list:
+    """Синхронное извлечение текста (выполняется в процессе пула)
+
+    Работает прямо с буфером в памяти и прекращает разбор, как только
+    набрано max_chars символов. Возвращает части текста по порядку; вместо
+    текста страницы PDF без текстового слоя — список её изображений для OCR
+    (не больше ocr_pages таких страниц).
+    """
+    name = filename.lower()
+    parts = []
+    size = 0
+    if name.endswith('.pdf'):
+        reader = PdfReader(io.BytesIO(file_bytes))
+        for page in reader.pages:
+            page_text = page.extract_text() or ""
+            if ocr_pages and len(page_text.strip()) < ocr.OCR_MIN_PAGE_CHARS:
+                images = _page_images(page)
+                if images:
+                    parts.append(images)
+                    ocr_pages -= 1
+                    continue
+            parts.append(page_text)
+            size += len(page_text) + 1
+            if size >= max_chars:
+                break
+    elif name.endswith('.docx'):
+        doc = docx.Document(io.BytesIO(file_bytes))
+        for p in doc.paragraphs:
+            parts.append(p.text)
+            size += len(p.text) + 1
+            if size >= max_chars:
+                break
+    else:  # пробуем как текстовый файл
+        # На символ приходится не больше 4 байт UTF-8 — остальное не читаем
+        parts.append(_decode_text(bytes(memoryview(file_bytes)[:max_chars * 4])))
+
+    return parts
+
+async def _recognize_parts(parts: list) -> str:
+    """Заменяет изображения страниц распознанным текстом (страницы — параллельно)"""
+    scans = [(i, image) for i, part in enumerate(parts) if isinstance(part, list) for image in part]
+    texts = await ocr.recognize([image for _, image in scans])
+    recognized = {}
+    for (i, _), text in zip(scans, texts):
+        recognized.setdefault(i, []).append(text)
+    return "\n".join("\n".join(recognized.get(i, [])) if isinstance(part, list) else part
+                     for i, part in enumerate(parts))
+
+async def extract_text_from_document(file_bytes: bytes, filename: str, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    """Извлекает текст из PDF, DOCX, TXT или изображения (до max_chars символов)
+
+    Фотографии и страницы PDF без текстового слоя распознаются OCR, если он доступен.
+    """
+    if ocr.is_image(filename):
+        texts = await ocr.recognize([file_bytes])
+        return texts[0][:max_chars]
+
+    ocr_pages = ocr.OCR_MAX_PAGES if ocr.available() else 0
+    parts = await _run_extract(file_bytes, filename, max_chars, ocr_pages)
+    if any(isinstance(part, list) for part in parts):
+        return (await _recognize_parts(parts))[:max_chars]
+    return "\n".join(parts)[:max_chars]  # ограничение для GigaChat
+
+async def _run_extract(file_bytes, filename, max_chars, ocr_pages) -> list:
+    """Разбор документа в отдельном процессе с ограничением времени
+
+    Одновременно разбирается не больше EXTRACT_WORKERS документов.
+    """
+    global _extract_slots
+    if _extract_slots is None:
+        _extract_slots = asyncio.Semaphore(EXTRACT_WORKERS)
+    started = time.monotonic()
+    extract_stats["jobs"] += 1
+    try:
+        async with _extract_slots:
+            return await _run_in_process((file_bytes, filename, max_chars, ocr_pages), EXTRACT_TIMEOUT)
+    except asyncio.TimeoutError:
+        extract_stats["timeouts"] += 1
+        metrics.stage_errors.inc(stage="extract")
+        raise
+    except Exception:
+        extract_stats["failures"] += 1
+        metrics.stage_errors.inc(stage="extract")
+        raise
     finally:
-        os.unlink(tmp_path)
-    
-    return text[:8000]  # ограничение для GigaChat
+        elapsed = time.monotonic() - started
+        metrics.stage_seconds.observe(elapsed, stage="extract")
+        extract_stats["seconds_total"] += elapsed
+        extract_stats["seconds_max"] = max(extract_stats["seconds_max"], elapsed)
@@ -0,0 +1,192 @@
+# delivery.py
+# Надёжная доставка исходящих запросов: повторы с экспоненциальной паузой,
+# автоматический выключатель (circuit breaker) на каждый внешний сервис
+# и сводки для администратора вместо отдельного сообщения на каждое событие.
+import os
+import time
+import random
+import asyncio
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))             # повторов отправки
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))          # первая пауза, сек.
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 10))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))              # ошибок подряд до размыкания
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))  # сек. до пробного запроса
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", 60))  # сек. между сводками
+ADMIN_DIGEST_MAX_ITEMS = int(os.getenv("ADMIN_DIGEST_MAX_ITEMS", 50))  # сводка отправляется раньше
+MESSAGE_MAX_CHARS = 4000
+
+class RetryableError(Exception):
+    """Временная ошибка сервиса (429, 5xx); retry_after — пауза, названная сервером
+
+    throttled — сервис ограничил частоту (429): он работает, поэтому такая
+    ошибка повторяется, но выключателю не засчитывается.
+    """
+
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+class CircuitOpen(Exception):
+    """Сервис считается недоступным, запрос не отправлялся"""
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRY_ON = (RetryableError, asyncio.TimeoutError, aiohttp.ClientConnectionError)
+
+class CircuitBreaker:
+    """После BREAKER_FAILURES ошибок подряд запросы к сервису не отправляются;
+    раз в reset_timeout пропускается один пробный, успех замыкает цепь"""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self._next_try = 0.0
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if now >= self._next_try:
+            self.state = "half_open"
+            self._next_try = now + self.reset_timeout
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def success(self):
+        self.stats["successes"] += 1
+        self.failures = 0
+        if self.state != "closed":
+            logger.info("Circuit %s closed", self.name)
+        self.state = "closed"
+
+    def failure(self):
+        self.stats["failures"] += 1
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state == "closed":
+                logger.warning("Circuit %s opened after %d failures", self.name, self.failures)
+                self.stats["opened"] += 1
+            self.state = "open"
+            self._next_try = time.monotonic() + self.reset_timeout
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["state"] = self.state
+        stats["failures_in_a_row"] = self.failures
+        return stats
+
+def backoff_delay(attempt, retry_after=None) -> float:
+    """Пауза перед повтором: Retry-After сервера или экспонента со случайным разбросом"""
+    if retry_after is not None:
+        return min(max(retry_after, 0), RETRY_MAX_DELAY)
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.5, 1)
+
+async def call_with_retries(func, breaker, retries=SEND_MAX_RETRIES):
+    """Вызывает корутину func() с повторами при временных ошибках
+
+    Ошибки из RETRY_ON (кроме ограничения частоты) засчитываются выключателю
+    и повторяются; прочие
+    исключения (например, 4xx) означают, что сервис отвечает, и пробрасываются
+    сразу. Разомкнутый выключатель — CircuitOpen без обращения к сервису.
+    """
+    for attempt in range(retries + 1):
+        if not breaker.allow():
+            raise CircuitOpen(breaker.name)
+        try:
+            result = await func()
+        except RETRY_ON as e:
+            if not getattr(e, "throttled", False):
+                breaker.failure()
+            if attempt >= retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, getattr(e, "retry_after", None)))
+            continue
+        except Exception:
+            breaker.success()
+            raise
+        breaker.success()
+        return result
+
+class Digest:
+    """Копит уведомления и отправляет их одной сводкой раз в interval секунд
+
+    send — корутина send(text); отправка идёт в фоне, вне пути ответа пользователю.
+    """
+
+    def __init__(self, send, title, interval=ADMIN_DIGEST_INTERVAL, max_items=ADMIN_DIGEST_MAX_ITEMS):
+        self.send = send
+        self.title = title
+        self.interval = interval
+        self.max_items = max_items
+        self._items = []
+        self._full = asyncio.Event()
+        self._task = None
+        self.stats = {"items": 0, "digests": 0, "send_failures": 0}
+
+    def add(self, text):
+        self._items.append(text)
+        self.stats["items"] += 1
+        if len(self._items) >= self.max_items:
+            self._full.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name=f"digest-{self.title}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._items:
+            return
+        items, self._items = self._items, []
+        self._full.clear()
+        for text in self._render(items):
+            if not await self.send(text):
+                self.stats["send_failures"] += 1
+        self.stats["digests"] += 1
+
+    def _render(self, items):
+        """Текст сводки, разбитый на сообщения не длиннее MESSAGE_MAX_CHARS"""
+        header = f"{self.title} ({len(items)}):"
+        messages = []
+        current = header
+        for item in items:
+            line = f"\n\n{item}"
+            if len(current) + len(line) > MESSAGE_MAX_CHARS and current != header:
+                messages.append(current)
+                current = header
+            current += line[:MESSAGE_MAX_CHARS - len(header)]
+        messages.append(current)
+        return messages
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Digest flush failed")
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending"] = len(self._items)
+        return stats
@@ -0,0 +1,86 @@
+# http_client.py
+# Общий пул HTTP-соединений для MAX API и GigaChat
+import os
+from collections import Counter
+import aiohttp
+
+# === Настройки пула ===
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))            # всего соединений
+HTTP_POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", 20))       # на один хост
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 60))             # сек. простоя keep-alive
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))                  # кеш DNS, сек.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+
+_session = None
+_events = Counter()       # счётчики событий пула (создание/переиспользование соединений, DNS)
+
+def _trace_config():
+    """Трассировка aiohttp для статистики пула"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        _events["requests"] += 1
+
+    async def on_connection_create_end(session, ctx, params):
+        _events["connections_created"] += 1
+
+    async def on_connection_reuseconn(session, ctx, params):
+        _events["connections_reused"] += 1
+
+    async def on_dns_cache_hit(session, ctx, params):
+        _events["dns_cache_hits"] += 1
+
+    async def on_dns_cache_miss(session, ctx, params):
+        _events["dns_cache_misses"] += 1
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace.on_dns_cache_hit.append(on_dns_cache_hit)
+    trace.on_dns_cache_miss.append(on_dns_cache_miss)
+    return trace
+
+def get_session() -> aiohttp.ClientSession:
+    """Долгоживущая aiohttp-сессия процесса (создаётся в работающем event loop)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            use_dns_cache=True,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[_trace_config()],
+        )
+    return _session
+
+async def close_session():
+    """Закрывает сессию (при остановке приложения)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def pool_stats() -> dict:
+    """Статистика пулов для подбора настроек"""
+    stats = {
+        "limits": {
+            "total": HTTP_POOL_LIMIT,
+            "per_host": HTTP_POOL_PER_HOST,
+            "keepalive": HTTP_KEEPALIVE,
+            "dns_ttl": HTTP_DNS_TTL,
+        },
+        "events": dict(_events),
+        "open": _session is not None and not _session.closed,
+    }
+    return stats
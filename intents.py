@@ -0,0 +1,161 @@
+# intents.py
+# Быстрый ответ без GigaChat на вопросы о ценах и контактах. Прайс-листы из
+# core разбираются при импорте в позиции (название, цена) с индексом по
+# основам слов; вопрос с «ценовым» словом и однозначным совпадением
+# получает ответ сразу, всё остальное уходит в модель.
+import re
+import math
+from collections import Counter
+import core
+import relevance
+
+# Слова вопроса сравниваются по началу: у коротких основ («услуг», «адрес»)
+# иначе совпадала бы только одна словоформа.
+# Вопрос о цене — только с явным «ценовым» словом; «сколько» и «цена»
+# (контракта, заявки) сами по себе о наших ценах не говорят
+PRICE_PREFIXES = ("стоит", "стоят", "стоим", "почем", "прайс", "расцен", "тариф", "прейск")
+ECP_PREFIXES = ("эцп", "подпис", "кэп")
+PRICE_LIST_PREFIXES = ("прайс", "услуг", "расцен", "тариф", "прейск")
+CONTACT_PREFIXES = ("контакт", "телефон", "адрес", "почт", "email", "mail", "позвон", "связат", "связь", "находит")
+# Вопрос о контактах должен быть обращён к компании («ваш телефон», «где вы находитесь»)
+COMPANY_PREFIXES = ("вы", "вас", "ваш", "вам", "тритик", "компани", "офис")
+# Слова, встречающиеся почти в каждом вопросе о цене, — не повод выбрать позицию
+STOP_PREFIXES = PRICE_PREFIXES + ("скольк", "цен", "для", "как", "что", "это", "или", "нуж", "ваш", "вас", "мне",
+                                  "руб", "услуг")
+# Общие слова закупок: совпадение только по ним не указывает на позицию
+# («стоимость контракта по закупке», «тариф площадки Сбербанк-АСТ»)
+GENERIC_PREFIXES = ECP_PREFIXES + ("торг", "закуп", "площад", "аст", "контракт", "коммер", "систем", "госуда",
+                                   "участ", "заявк", "электрон", "доп")
+MIN_QUERY_SHARE = 0.5  # доля значимых слов вопроса, которые должны совпасть с позицией
+MAX_CONTACT_WORDS = 5
+
+_WORD_RE = re.compile(r"\w+")
+# «стоит ли участвовать», «стоимость контракта» — не о наших ценах
+_NOT_PRICE_RE = re.compile(r"\bстоит\s+ли\b|\bстоимост\w*\s+(?:контракт|закуп|лот|договор|работ|товар)")
+
+def _words(text: str) -> list:
+    return _WORD_RE.findall(text.lower().replace("ё", "е"))
+
+def _has(words, prefixes) -> bool:
+    return any(word.startswith(prefixes) for word in words)
+
+def _matches(word: str, stem: str) -> bool:
+    """Слово вопроса — форма слова позиции (основа позиции короче или длиннее слова)"""
+    return word.startswith(stem) or (len(word) >= 4 and stem.startswith(word))
+
+MIN_ITEM_SCORE = 1.0   # минимальный вес совпадения (сумма IDF) для ответа одной позицией
+MAX_ITEMS = 3
+
+CONTACTS = """📞 Контакты ООО "Тритика":
+📍 г. Владимир, ул. Разина, д. 51, 3 этаж
+📞 +7(4922)223-222, +7(904)6536987
+📧 info@tritika.ru"""
+
+PRICE_NOTE = "ℹ️ Цены могут варьироваться в зависимости от сложности.\n📞 Для заказа и консультации: +7(4922)223-222"
+
+_ITEM_RE = re.compile(r"^\s*(?:•|\d+(?:-\d+)?\.)?\s*(.+?)\s+—\s+(.+₽.*)$")
+_NUMBERED_RE = re.compile(r"^\s*\d+(?:-\d+)?\.\s*")
+
+class PriceItem:
+    def __init__(self, name, price, section):
+        self.name = name
+        self.price = price
+        self.section = section
+        self.stems = {stem for stem in relevance.tokenize(f"{section} {name}") if not stem.startswith(STOP_PREFIXES)}
+
+    def render(self) -> str:
+        prefix = f"{self.section}: " if self.section else ""
+        return f"• {prefix}{self.name} — {self.price}"
+
+def parse_price_list(text, section_prefix="") -> list:
+    """Позиции прайс-листа; пункты «•» получают заголовок родительского пункта"""
+    items = []
+    section = section_prefix
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith(("ℹ️", "📞", "📌", "🔐")):
+            continue
+        match = _ITEM_RE.match(stripped)
+        bullet = stripped.startswith("•")
+        if match:
+            items.append(PriceItem(match.group(1), match.group(2), section if bullet else section_prefix))
+            if not bullet:
+                section = _NUMBERED_RE.sub("", match.group(1))
+            continue
+        # Заголовок группы без цены («Коммерческие площадки:», «11. Участие в торгах:»)
+        heading = _NUMBERED_RE.sub("", stripped).rstrip(":")
+        section = f"{section_prefix} {heading}".strip() if section_prefix else heading
+    return items
+
+class PriceIndex:
+    def __init__(self, items):
+        self.items = items
+        df = Counter(stem for item in items for stem in item.stems)
+        self.idf = {stem: math.log(1 + len(items) / n) for stem, n in df.items()}
+
+    def search(self, query) -> list:
+        """Позиции с наибольшим весом совпавших основ (не больше MAX_ITEMS); query — слова вопроса
+
+        Позиция подходит, если среди совпавших основ есть не общая (GENERIC_PREFIXES)
+        и совпала хотя бы MIN_QUERY_SHARE значимых слов вопроса.
+        """
+        scored = []
+        for item in self.items:
+            matched = [s for s in item.stems if any(_matches(word, s) for word in query)]
+            if all(s.startswith(GENERIC_PREFIXES) for s in matched):
+                continue
+            covered = sum(1 for word in query if any(_matches(word, s) for s in matched))
+            if covered < len(query) * MIN_QUERY_SHARE:
+                continue
+            score = sum(self.idf[s] for s in matched)
+            if score >= MIN_ITEM_SCORE:
+                scored.append((score, item))
+        if not scored:
+            return []
+        best = max(score for score, _ in scored)
+        return [item for score, item in scored if score == best][:MAX_ITEMS]
+
+# Разбор прайс-листов — один раз при запуске
+SERVICE_ITEMS = parse_price_list(core.get_price_list())
+ECP_ITEMS = parse_price_list(core.get_ecp_price(), "ЭЦП")
+SERVICE_INDEX = PriceIndex(SERVICE_ITEMS)
+ECP_INDEX = PriceIndex(ECP_ITEMS)
+
+def _price_answer(items) -> str:
+    return "💰 " + "\n".join(item.render() for item in items).lstrip("• ") + "\n\n" + PRICE_NOTE
+
+def route(text: str):
+    """(интент, готовый ответ) на вопрос о цене или контактах; (None, None) — нужен GigaChat"""
+    found = [word for word in _words(text) if len(word) > 1]
+    if not found:
+        return None, None
+
+    if _has(found, PRICE_PREFIXES) and not _NOT_PRICE_RE.search(" ".join(found)):
+        query = [word for word in found if len(word) > 2 and not word.startswith(STOP_PREFIXES)]
+        about_ecp = _has(query, ECP_PREFIXES)
+        # Вопрос об ЭЦП сначала ищем в прайсе ЭЦП, иначе — в прайсе услуг;
+        # само слово «ЭЦП» не должно притягивать услуги вроде настройки ПК
+        other = [word for word in query if not word.startswith(ECP_PREFIXES)]
+        if about_ecp:
+            searches = ((ECP_INDEX, other), (SERVICE_INDEX, other))
+        else:
+            searches = ((SERVICE_INDEX, query), (ECP_INDEX, query))
+        for index, index_query in searches:
+            items = index.search(index_query)
+            if about_ecp and index is SERVICE_INDEX:
+                # Услуга без ЭЦП в названии («МЧД и ЭЦП») ответила бы только на часть вопроса
+                items = [item for item in items if any(s.startswith(ECP_PREFIXES) for s in item.stems)]
+            if items:
+                return "price_item", _price_answer(items)
+        # Список целиком — только если кроме ЭЦП или «услуг» вопрос ни о чём не спрашивает
+        if about_ecp and not other:
+            return "ecp_price", core.get_ecp_price().strip()
+        if not query or (_has(found, PRICE_LIST_PREFIXES) and all(w.startswith(PRICE_LIST_PREFIXES) for w in query)):
+            return "price_list", core.get_price_list().strip()
+        return None, None
+
+    # Короткий вопрос о контактах компании («ваш телефон?», «где вы находитесь»)
+    if len(found) <= MAX_CONTACT_WORDS and _has(found, CONTACT_PREFIXES):
+        if len(found) == 1 or _has(found, COMPANY_PREFIXES):
+            return "contacts", CONTACTS
+    return None, None
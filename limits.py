@@ -0,0 +1,234 @@
+# limits.py
+# Ограничение нагрузки: token bucket на входящие сообщения (на каждый чат
+# и на весь бот) и адаптивный ограничитель одновременных запросов к GigaChat.
+import os
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+CHAT_RATE = float(os.getenv("CHAT_RATE", 0.5))                 # сообщений в секунду на чат
+CHAT_BURST = float(os.getenv("CHAT_BURST", 5))                 # запас сообщений подряд
+DOCUMENT_COST = float(os.getenv("DOCUMENT_COST", 3))           # документ «стоит» как N сообщений
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", 20))              # сообщений в секунду на весь бот
+GLOBAL_BURST = float(os.getenv("GLOBAL_BURST", 100))
+RATE_MAX_KEYS = int(os.getenv("RATE_MAX_KEYS", 10000))         # отслеживаемых чатов
+
+GIGACHAT_CONCURRENCY = int(os.getenv("GIGACHAT_CONCURRENCY", 8))          # начальный лимит
+GIGACHAT_CONCURRENCY_MIN = int(os.getenv("GIGACHAT_CONCURRENCY_MIN", 1))
+GIGACHAT_CONCURRENCY_MAX = int(os.getenv("GIGACHAT_CONCURRENCY_MAX", 32))
+OVERLOAD_PAUSE = float(os.getenv("OVERLOAD_PAUSE", 1))         # пауза после 429/5xx без Retry-After
+OVERLOAD_PAUSE_MAX = float(os.getenv("OVERLOAD_PAUSE_MAX", 30))
+
+# Ответы GigaChat, после которых снижаем нагрузку
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+
+# Чат, от имени которого идут запросы к GigaChat (для справедливой очереди)
+current_chat = contextvars.ContextVar("current_chat", default=None)
+# Когда текущий запрос получил слот (перегрузки запросов, отправленных до
+# последнего снижения лимита, повторно его не снижают)
+_slot_started = contextvars.ContextVar("slot_started", default=None)
+
+class RateLimiter:
+    """Token bucket для каждого ключа: rate пополнений в секунду, не больше burst"""
+
+    def __init__(self, rate, burst, max_keys=RATE_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [tokens, updated_at, rejected_in_a_row]
+        self.stats = {"allowed": 0, "rejected": 0}
+
+    def allow(self, key=None, cost=1.0) -> bool:
+        """Списывает cost токенов; False — лимит исчерпан"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now, 0]
+            # Давно не писавшие чаты вытесняем — их корзины всё равно были бы полными
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            bucket[2] = 0
+            self.stats["allowed"] += 1
+            return True
+        bucket[2] += 1
+        self.stats["rejected"] += 1
+        return False
+
+    def first_rejection(self, key=None) -> bool:
+        """Последний отказ для ключа — первый подряд (о нём стоит сообщить пользователю)"""
+        bucket = self._buckets.get(key)
+        return bucket is not None and bucket[2] == 1
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["rate"] = self.rate
+        stats["burst"] = self.burst
+        stats["keys"] = len(self._buckets)
+        return stats
+
+class ConcurrencyGovernor:
+    """Адаптивный лимит одновременных запросов (AIMD)
+
+    Успешный ответ понемногу поднимает лимит, 429/5xx/таймаут — вдвое снижают
+    его и приостанавливают выдачу слотов (на Retry-After, если сервер его прислал).
+    Одна перегрузка обычно отвечает сразу нескольким запросам, поэтому лимит
+    снижается не чаще раза за окно: ответы на запросы, отправленные до снижения,
+    и всё, что пришло в течение паузы и ещё одного запроса после него, не учитываются.
+    Ожидающие обслуживаются по кругу между чатами: документ, разбитый на десятки
+    фрагментов, не задерживает вопросы других пользователей.
+    """
+
+    def __init__(self, initial=GIGACHAT_CONCURRENCY, minimum=GIGACHAT_CONCURRENCY_MIN,
+                 maximum=GIGACHAT_CONCURRENCY_MAX):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.active = 0
+        self._waiters = OrderedDict()   # чат -> deque[Future]
+        self._paused_until = 0.0
+        self._cut_at = 0.0      # последнее снижение лимита
+        self._cut_until = 0.0   # до этого момента перегрузки лимит не снижают
+        self.rtt = 0.0          # скользящее среднее длительности запроса
+        self.stats = {
+            "acquired": 0,
+            "queued": 0,
+            "overloads": 0,
+            "cuts": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    @asynccontextmanager
+    async def slot(self, owner=None):
+        """Слот на один запрос; owner по умолчанию — текущий чат"""
+        await self.acquire(current_chat.get() if owner is None else owner)
+        started = time.monotonic()
+        token = _slot_started.set(started)
+        try:
+            yield
+        finally:
+            _slot_started.reset(token)
+            elapsed = time.monotonic() - started
+            self.rtt = elapsed if not self.rtt else self.rtt * 0.8 + elapsed * 0.2
+            self.release()
+
+    async def acquire(self, owner=None):
+        started = time.monotonic()
+        if self.active < int(self.limit) and not self._waiters:
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(owner, deque()).append(future)
+            self.stats["queued"] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Слот уже выдан — возвращаем его следующему
+                    self.release()
+                else:
+                    self._discard(owner, future)
+                raise
+        try:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+        wait = time.monotonic() - started
+        self.stats["acquired"] += 1
+        self.stats["wait_total"] += wait
+        self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def succeeded(self):
+        """Аддитивный рост: +1 к лимиту примерно за «лимит» успешных ответов"""
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def overloaded(self, retry_after=None):
+        """Мультипликативное снижение (не чаще раза за окно) и пауза после 429/5xx/таймаута"""
+        self.stats["overloads"] += 1
+        pause = OVERLOAD_PAUSE if retry_after is None else retry_after
+        pause = min(max(pause, 0), OVERLOAD_PAUSE_MAX)
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + pause)
+        started = _slot_started.get()
+        if now < self._cut_until or (started is not None and started < self._cut_at):
+            # Та же перегрузка, на которую лимит уже снижен
+            return
+        self.stats["cuts"] += 1
+        self.limit = max(float(self.minimum), self.limit / 2)
+        self._cut_at = now
+        self._cut_until = now + pause + self.rtt
+
+    def _wake(self):
+        while self._waiters and self.active < int(self.limit):
+            owner, queue = self._waiters.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                # Следующий запрос этого чата — в конец круга
+                self._waiters[owner] = queue
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    def _discard(self, owner, future):
+        queue = self._waiters.get(owner)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._waiters[owner]
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        wait_total = stats.pop("wait_total")
+        stats["wait_avg"] = round(wait_total / stats["acquired"], 4) if stats["acquired"] else 0.0
+        stats["wait_max"] = round(stats["wait_max"], 4)
+        stats["limit"] = round(self.limit, 2)
+        stats["rtt"] = round(self.rtt, 4)
+        stats["active"] = self.active
+        stats["waiting"] = sum(len(q) for q in self._waiters.values())
+        stats["waiting_chats"] = len(self._waiters)
+        stats["paused_for"] = round(max(0.0, self._paused_until - time.monotonic()), 2)
+        return stats
+
+def retry_after(headers):
+    """Значение Retry-After в секундах (или None)"""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+chat_limiter = RateLimiter(CHAT_RATE, CHAT_BURST)
+global_limiter = RateLimiter(GLOBAL_RATE, GLOBAL_BURST, max_keys=1)
+gigachat = ConcurrencyGovernor()
+
+def snapshot() -> dict:
+    return {
+        "chat": chat_limiter.snapshot(),
+        "global": global_limiter.snapshot(),
+        "gigachat": gigachat.snapshot(),
+    }
@@ -0,0 +1,114 @@
+# logs.py
+# Настройка логирования: записи складываются в очередь и выводятся отдельным
+# потоком, поэтому запись в stdout (и форматирование трассировок) не задерживает
+# обработку запросов. Уровни задаются для всего бота и отдельно для подсистем.
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+# Уровни подсистем: "core=DEBUG,state=WARNING"; журнал доступа aiohttp по умолчанию выключен
+LOG_LEVELS = os.getenv("LOG_LEVELS", "aiohttp.access=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                        # text или json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))            # при переполнении записи теряются
+LOG_PAYLOAD_SAMPLE = float(os.getenv("LOG_PAYLOAD_SAMPLE", 0.01))   # доля обновлений, выводимых целиком (DEBUG)
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 2000))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+stats = {"dropped": 0}
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь, не форматируя её и не ожидая места"""
+
+    def prepare(self, record):
+        # Подставляем аргументы сразу (они могут измениться), а трассировку
+        # форматирует уже поток вывода
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+def setup():
+    """Направляет корневой логгер через очередь в stdout"""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    # request id читается в потоке, где сделана запись
+    handler.addFilter(metrics.RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    for item in LOG_LEVELS.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+def shutdown():
+    """Дописывает оставшиеся в очереди записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def describe_update(update) -> str:
+    """Краткое описание обновления для лога (без текста и метаданных файлов)"""
+    update_type = update.get("update_type")
+    message = update.get("message") or {}
+    chat_id = message.get("chat", {}).get("chat_id", update.get("chat_id"))
+    if "document" in message:
+        kind = "document"
+    elif "photo" in message:
+        kind = "photo"
+    elif message.get("text"):
+        kind = f"text[{len(message['text'])}]"
+    else:
+        kind = "-"
+    return f"type={update_type} chat={chat_id} content={kind}"
+
+def log_payload(logger, update):
+    """Выборочно выводит обновление целиком (только на уровне DEBUG, с обрезкой)"""
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_PAYLOAD_SAMPLE:
+        return
+    logger.debug("Update payload: %s", json.dumps(update, ensure_ascii=False)[:LOG_PAYLOAD_MAX_CHARS])
+
+def snapshot() -> dict:
+    result = dict(stats)
+    result["queued"] = _listener.queue.qsize() if _listener is not None else 0
+    return result
@@ -0,0 +1,138 @@
+# metrics.py
+# Метрики в текстовом формате Prometheus и сквозной request id в логах.
+# Гистограммы длительности по этапам (скачивание, разбор, токен, GigaChat,
+# отправка), счётчики ошибок по кодам ответа и датчики, значения которых
+# читаются из снимков очереди, кеша и лимитов в момент запроса /metrics.
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, сек.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Идентификатор обрабатываемого обновления — попадает в каждую строку лога
+request_id = contextvars.ContextVar("request_id", default="-")
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+def _labels(labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+class Histogram:
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values = {}   # labels -> [счётчики по корзинам, сумма, количество]
+
+    def observe(self, value, **labels):
+        key = _labels(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{_format_labels(labels, ('le', bound))} {bucket_count}"
+            yield f"{self.name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {round(total, 6)}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+class Gauge:
+    """Датчик, значение которого вычисляет callback при каждом запросе /metrics
+
+    callback возвращает число либо словарь {значение метки: число}.
+    """
+
+    def __init__(self, name, help, callback, label=None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label = label
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if isinstance(value, dict):
+            for label_value, v in value.items():
+                yield f"{self.name}{_format_labels([(self.label, label_value)])} {_format_value(v)}"
+        else:
+            yield f"{self.name} {_format_value(value)}"
+
+stage_seconds = Histogram("tenderbot_stage_seconds", "Duration of processing stages")
+stage_errors = Counter("tenderbot_stage_errors_total", "Processing stages that ended with an exception")
+http_errors = Counter("tenderbot_http_errors_total", "Non-successful responses of external services by status code")
+updates = Counter("tenderbot_updates_total", "Processed updates by type")
+fast_path = Counter("tenderbot_fast_path_total", "Questions answered without GigaChat by intent")
+gigachat_tokens = Counter("tenderbot_gigachat_tokens_total", "GigaChat tokens by task, model and kind (prompt/completion)")
+
+_registry = [stage_seconds, stage_errors, http_errors, updates, fast_path, gigachat_tokens]
+
+def register_gauge(name, help, callback, label=None):
+    _registry.append(Gauge(name, help, callback, label))
+
+@contextmanager
+def stage(name):
+    """Замер длительности этапа (работает и вокруг await)"""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        stage_seconds.observe(time.monotonic() - started, stage=name)
+
+def http_error(service, status):
+    http_errors.inc(service=service, status=status)
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
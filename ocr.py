@@ -0,0 +1,133 @@
+# ocr.py
+# Распознавание текста (Tesseract) для фотографий и страниц PDF без
+# текстового слоя. Работает в собственном пуле процессов небольшого размера,
+# чтобы сканы не отнимали процессор у разбора обычных документов и у
+# обработки сообщений. Результат кешируется по хешу изображения.
+#
+# Требует пакеты pytesseract и Pillow и установленный tesseract с языковыми
+# данными (OCR_LANG); без них распознавание просто отключено.
+import os
+import io
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import cache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1") == "1"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+OCR_LANG = os.getenv("OCR_LANG", "rus+eng")
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 60))              # сек. на одно изображение
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 20))            # страниц без текста, распознаваемых в одном PDF
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", 20))  # меньше — страница считается сканом
+OCR_MEMORY_MB = int(os.getenv("OCR_MEMORY_MB", 1024))
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp')
+
+_pool = None
+_available = None
+ocr_stats = {"images": 0, "cache_hits": 0, "failures": 0, "seconds_total": 0.0, "seconds_max": 0.0}
+
+def is_image(filename: str) -> bool:
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def available() -> bool:
+    """Есть ли pytesseract, Pillow и сам tesseract (проверяется один раз)"""
+    global _available
+    if _available is None:
+        if not OCR_ENABLED:
+            _available = False
+            return _available
+        try:
+            import pytesseract
+            import PIL.Image  # noqa: F401
+            pytesseract.get_tesseract_version()
+            _available = True
+        except Exception as e:
+            logger.warning("OCR is unavailable: %r", e)
+            _available = False
+    return _available
+
+def _address_space() -> int:
+    """Текущий размер адресного пространства процесса, байт (0 — неизвестен)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def _init_worker():
+    """Tesseract в обработчике — однопоточный и с ограничением памяти (Unix)
+
+    Обработчик получен fork() от бота, поэтому OCR_MEMORY_MB отсчитывается
+    от унаследованного размера адресного пространства.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    logging.getLogger().handlers[:] = [logging.StreamHandler()]
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = _address_space() + OCR_MEMORY_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=_init_worker)
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _recognize_sync(image_bytes: bytes, lang: str, timeout: float) -> str:
+    """Распознавание одного изображения (выполняется в процессе пула)"""
+    import pytesseract
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    # По истечении timeout pytesseract завершает процесс tesseract
+    return pytesseract.image_to_string(image, lang=lang, timeout=timeout)
+
+async def _recognize_one(image_bytes: bytes) -> str:
+    key = "ocr:" + hashlib.sha256(image_bytes).hexdigest()
+    if cache.response_cache is not None:
+        cached = cache.response_cache.get(key)
+        if cached is not None:
+            ocr_stats["cache_hits"] += 1
+            return cached
+
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    ocr_stats["images"] += 1
+    try:
+        with metrics.stage("ocr"):
+            text = await loop.run_in_executor(_get_pool(), _recognize_sync, bytes(image_bytes), OCR_LANG, OCR_TIMEOUT)
+    except Exception as e:
+        ocr_stats["failures"] += 1
+        logger.warning("OCR failed: %r", e)
+        return ""
+    finally:
+        elapsed = time.monotonic() - started
+        ocr_stats["seconds_total"] += elapsed
+        ocr_stats["seconds_max"] = max(ocr_stats["seconds_max"], elapsed)
+
+    text = text.strip()
+    if cache.response_cache is not None:
+        cache.response_cache.set(key, text)
+    return text
+
+async def recognize(images: list) -> list:
+    """Тексты изображений в том же порядке; изображения распознаются параллельно
+    (одновременно — не больше OCR_WORKERS, остальные ждут в очереди пула)"""
+    if not images or not available():
+        return [""] * len(images)
+    return await asyncio.gather(*[_recognize_one(image) for image in images])
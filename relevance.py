@@ -0,0 +1,122 @@
+# relevance.py
+# Локальный BM25-индекс по разделам документа: из документации о закупке
+# выбираются разделы, важные для анализа, вместо первых N символов.
+import re
+import math
+from collections import Counter
+
+SECTION_MAX_CHARS = 3000      # длинные разделы делим на части не больше этого размера
+HEADING_WEIGHT = 3            # совпадение в заголовке весит больше, чем в тексте
+STEM_LENGTH = 6               # усечение слов вместо морфологии
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Что ищем в тендерной документации
+TENDER_QUERY = """
+требования к участникам закупки единые требования документы в составе заявки
+обеспечение заявки размер обеспечения заявки
+обеспечение исполнения контракта банковская гарантия
+гарантийные обязательства гарантийный срок обеспечение гарантийных обязательств
+проект контракта существенные условия ответственность сторон штраф пени неустойка
+начальная максимальная цена контракта НМЦК срок подачи заявок срок исполнения
+приемка оплата порядок оплаты срок оплаты
+"""
+
+_HEADING_RE = re.compile(
+    r"^\s*(?:(?:раздел|глава|статья|часть|приложение)\b|\d+(?:\.\d+)*\.?\s+\S|[IVXLC]+\.\s+\S)",
+    re.IGNORECASE,
+)
+_WORD_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> list:
+    """Слова в нижнем регистре, усечённые до основы"""
+    return [w[:STEM_LENGTH] for w in _WORD_RE.findall(text.lower().replace("ё", "е")) if len(w) > 2]
+
+def _is_heading(line: str) -> bool:
+    line = line.strip()
+    if not line or len(line) > 120:
+        return False
+    if _HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 5 and all(c.isupper() for c in letters)
+
+def split_sections(text: str) -> list:
+    """Разбивает текст на разделы [(заголовок, текст)] по строкам-заголовкам"""
+    sections = []
+    heading, body, size = "", [], 0
+
+    def flush():
+        if any(line.strip() for line in body):
+            sections.append((heading, "\n".join(body)))
+
+    for line in text.split("\n"):
+        if _is_heading(line):
+            flush()
+            heading, body, size = line.strip(), [line], len(line) + 1
+            continue
+        if size + len(line) + 1 > SECTION_MAX_CHARS and body:
+            flush()
+            body, size = [], 0
+        body.append(line)
+        size += len(line) + 1
+    flush()
+    return sections
+
+class SectionIndex:
+    """BM25 по разделам документа (заголовок учитывается с весом HEADING_WEIGHT)"""
+
+    def __init__(self, sections: list):
+        self.sections = sections
+        self.docs = []
+        for heading, body in sections:
+            terms = Counter(tokenize(body))
+            for term in tokenize(heading):
+                terms[term] += HEADING_WEIGHT - 1
+            self.docs.append(terms)
+        self.lengths = [sum(d.values()) for d in self.docs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        df = Counter()
+        for d in self.docs:
+            df.update(d.keys())
+        n = len(self.docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def scores(self, query: str) -> list:
+        terms = set(tokenize(query))
+        result = []
+        for d, length in zip(self.docs, self.lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            for t in terms:
+                tf = d.get(t)
+                if tf:
+                    score += self.idf[t] * tf * (BM25_K1 + 1) / (tf + norm)
+            result.append(score)
+        return result
+
+def select_relevant(text: str, budget: int = None, query: str = TENDER_QUERY) -> str:
+    """Самые релевантные разделы в пределах budget символов, в порядке документа
+
+    Первый раздел (обычно извещение: предмет и цена закупки) берётся всегда.
+    Разделы без совпадений с запросом не включаются.
+    """
+    sections = split_sections(text)
+    if not sections:
+        return ""
+    scores = SectionIndex(sections).scores(query)
+    order = sorted(range(1, len(sections)), key=lambda i: scores[i], reverse=True)
+
+    chosen = {0}
+    used = len(sections[0][1])
+    for i in order:
+        if scores[i] <= 0:
+            break
+        size = len(sections[i][1]) + 2
+        if budget is not None and used + size > budget:
+            continue
+        chosen.add(i)
+        used += size
+
+    selected = "\n…\n".join(sections[i][1] for i in sorted(chosen))
+    return selected[:budget] if budget is not None else selected
@@ -0,0 +1,336 @@
+# state.py
+# Хранилище состояний бота (режим пользователя, связь пересланных сообщений
+# с пользователями). Бэкенд выбирается переменной STATE_BACKEND:
+#   memory — словарь в памяти процесса с вытеснением по TTL;
+#   sqlite — файл SQLite (переживает перезапуск);
+#   redis  — Redis или совместимый сервер, общий для нескольких процессов.
+import os
+import time
+import json
+import asyncio
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_PATH = os.getenv("STATE_PATH", "state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", 0.2))  # сек. между пакетными записями
+USER_STATE_TTL = int(os.getenv("USER_STATE_TTL", 30 * 24 * 3600))
+FORWARD_TTL = int(os.getenv("FORWARD_TTL", 7 * 24 * 3600))          # сколько ждать ответа менеджера
+
+# Пространства ключей
+USER_STATE = "user_state"
+FORWARD = "forward"
+
+class StateStore(ABC):
+    """Общий интерфейс хранилища: значения в JSON, ключи — (пространство, id)"""
+
+    @abstractmethod
+    async def get(self, namespace, key):
+        ...
+
+    @abstractmethod
+    async def set(self, namespace, key, value, ttl):
+        ...
+
+    @abstractmethod
+    async def pop(self, namespace, key):
+        ...
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    # --- Удобные обёртки для бота ---
+
+    async def get_user_state(self, chat_id, default="main"):
+        value = await self.get(USER_STATE, chat_id)
+        return default if value is None else value
+
+    async def set_user_state(self, chat_id, value):
+        await self.set(USER_STATE, chat_id, value, USER_STATE_TTL)
+
+    async def remember_forward(self, message_id, user_id):
+        """Запоминает, от какого пользователя пересланное менеджеру сообщение"""
+        await self.set(FORWARD, message_id, user_id, FORWARD_TTL)
+
+    async def pop_forward(self, message_id):
+        return await self.pop(FORWARD, message_id)
+
+class MemoryStore(StateStore):
+    """Словарь в памяти с TTL; просроченные записи вычищаются в фоне"""
+
+    def __init__(self, sweep_interval=60):
+        self._data = {}            # (namespace, key) -> (expires_at, value)
+        self._sweep_interval = sweep_interval
+        self._task = None
+
+    async def get(self, namespace, key):
+        entry = self._data.get((namespace, key))
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._data[(namespace, key)]
+            return None
+        return entry[1]
+
+    async def set(self, namespace, key, value, ttl):
+        self._data[(namespace, key)] = (time.time() + ttl, value)
+
+    async def pop(self, namespace, key):
+        entry = self._data.pop((namespace, key), None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop(), name="state-sweep")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def sweep(self):
+        now = time.time()
+        expired = [k for k, (expires_at, _) in self._data.items() if expires_at <= now]
+        for k in expired:
+            del self._data[k]
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            self.sweep()
+
+    def snapshot(self) -> dict:
+        return {"backend": "memory", "size": len(self._data)}
+
+class BatchingStore(StateStore):
+    """Запись пакетами: изменения копятся в памяти и сбрасываются раз в
+    STATE_FLUSH_INTERVAL; чтение сначала смотрит в несброшенные изменения,
+    затем в пакет, который записывается в этот момент"""
+
+    def __init__(self, flush_interval=STATE_FLUSH_INTERVAL):
+        self._pending = {}         # (namespace, key) -> (expires_at, value)
+        self._flushing = {}        # пакет, запись которого ещё не завершена
+        self._removed = set()      # ключи из _flushing, удалённые во время записи
+        self._flush_interval = flush_interval
+        self._task = None
+        self.stats = {"flushes": 0, "written": 0}
+
+    async def get(self, namespace, key):
+        entry = self._pending.get((namespace, key)) or self._flushing.get((namespace, key))
+        if entry is not None:
+            return entry[1] if entry[0] > time.time() else None
+        return await self._read(namespace, key)
+
+    async def set(self, namespace, key, value, ttl):
+        self._pending[(namespace, key)] = (time.time() + ttl, value)
+
+    async def pop(self, namespace, key):
+        # Удаление сразу уходит в хранилище: ответ менеджера должен быть доставлен один раз
+        entry = self._pending.pop((namespace, key), None)
+        flushing = self._flushing.pop((namespace, key), None)
+        if flushing is not None:
+            # Запись уже в пути — ключ удаляется ещё раз, когда она завершится
+            self._removed.add((namespace, key))
+            entry = entry or flushing
+        stored = await self._take(namespace, key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        return stored
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="state-flush")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._flushing = dict(batch)
+        try:
+            await self._write(batch)
+        except Exception:
+            logger.exception("State flush failed")
+            # Возвращаем несохранённое, не перетирая более свежие изменения
+            # и не возвращая удалённое во время записи
+            for k, v in batch.items():
+                if k not in self._removed:
+                    self._pending.setdefault(k, v)
+            return
+        finally:
+            self._flushing = {}
+            removed, self._removed = self._removed, set()
+        for namespace, key in removed:
+            await self._take(namespace, key)
+        self.stats["flushes"] += 1
+        self.stats["written"] += len(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+    def snapshot(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending"] = len(self._pending)
+        return stats
+
+    @abstractmethod
+    async def _read(self, namespace, key):
+        ...
+
+    @abstractmethod
+    async def _take(self, namespace, key):
+        ...
+
+    @abstractmethod
+    async def _write(self, batch):
+        ...
+
+class SQLiteStore(BatchingStore):
+    """SQLite-файл; поиск по первичному ключу, запись пакетами в одной транзакции
+
+    Изменения (пакеты и удаления) выполняются в отдельном потоке через своё
+    соединение, по одному: commit с fsync не задерживает event loop.
+    """
+
+    def __init__(self, path=STATE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._writer = None             # соединение потока записи
+        self._write_lock = asyncio.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._db.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+        self._db.commit()
+
+    async def _read(self, namespace, key):
+        row = self._db.execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, str(key), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _connection(self):
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, check_same_thread=False)
+        return self._writer
+
+    def _take_sync(self, namespace, key):
+        db = self._connection()
+        with db:
+            row = db.execute(
+                "DELETE FROM state WHERE namespace = ? AND key = ? AND expires_at > ? RETURNING value",
+                (namespace, str(key), time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_sync(self, upserts):
+        db = self._connection()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                           upserts)
+            db.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+
+    async def _take(self, namespace, key):
+        async with self._write_lock:
+            return await asyncio.to_thread(self._take_sync, namespace, key)
+
+    async def _write(self, batch):
+        upserts = [(ns, str(k), json.dumps(v[1]), v[0]) for (ns, k), v in batch.items()]
+        async with self._write_lock:
+            await asyncio.to_thread(self._write_sync, upserts)
+
+    async def close(self):
+        await super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._db.close()
+
+    def snapshot(self) -> dict:
+        stats = super().snapshot()
+        stats["backend"] = "sqlite"
+        return stats
+
+class RedisStore(BatchingStore):
+    """Redis (или совместимый сервер); запись пакетами через pipeline
+
+    client — готовый асинхронный клиент с интерфейсом redis.asyncio.Redis;
+    позволяет подставить локальную замену (например, fakeredis) в тестах.
+    """
+
+    def __init__(self, url=REDIS_URL, client=None, prefix="tenderbot", **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package")
+            client = redis.from_url(url)
+        self._redis = client
+        self.prefix = prefix
+
+    def _key(self, namespace, key):
+        return f"{self.prefix}:{namespace}:{key}"
+
+    async def _read(self, namespace, key):
+        raw = await self._redis.get(self._key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    async def _take(self, namespace, key):
+        raw = await self._redis.getdel(self._key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    async def _write(self, batch):
+        now = time.time()
+        pipe = self._redis.pipeline(transaction=False)
+        for (ns, k), v in batch.items():
+            ttl = int(v[0] - now)
+            if ttl > 0:
+                pipe.set(self._key(ns, k), json.dumps(v[1]), ex=ttl)
+        await pipe.execute()
+
+    async def close(self):
+        await super().close()
+        await self._redis.aclose()
+
+    def snapshot(self) -> dict:
+        stats = super().snapshot()
+        stats["backend"] = "redis"
+        return stats
+
+def create_store(backend=STATE_BACKEND) -> StateStore:
+    """Хранилище по имени бэкенда"""
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SQLiteStore()
+    if backend == "redis":
+        return RedisStore()
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
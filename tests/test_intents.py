@@ -0,0 +1,45 @@
+import pytest
+import intents
+
+@pytest.mark.parametrize("question, intent", [
+    ("сколько стоит регистрация в ЕРУЗ", "price_item"),
+    ("Сколько стоит МЧД?", "price_item"),
+    ("какая стоимость сопровождения по 223-ФЗ", "price_item"),
+    ("стоимость подписи для физлица", "price_item"),
+    ("сколько стоит настройка ЭЦП", "price_item"),
+    ("стоимость ЭЦП для B2B-Center", "price_item"),
+    ("сколько стоит жалоба в ФАС", "price_item"),
+    ("почём ЭЦП", "ecp_price"),
+    ("сколько стоят ваши услуги", "price_list"),
+    ("прайс", "price_list"),
+    ("ваш телефон?", "contacts"),
+    ("где вы находитесь", "contacts"),
+    ("как с вами связаться", "contacts"),
+])
+def test_route_answers_price_and_contact_questions(question, intent):
+    found, answer = intents.route(question)
+    assert found == intent
+    assert answer
+
+@pytest.mark.parametrize("question", [
+    "Сколько длится регистрация в ЕРУЗ?",
+    "сколько дней на подачу жалобы в ФАС",
+    "какая цена контракта по 223-ФЗ допустима",
+    "сколько участников нужно для торгов",
+    "сколько нужно времени чтобы получить ЭЦП",
+    "адрес площадки B2B-Center",
+    "стоит ли участвовать в торгах",
+    "сколько стоит банковская гарантия",
+    # Совпадение только по общим словам закупок не выбирает позицию
+    "стоимость контракта по закупке",
+    "стоимость эцп для торгов",
+    "тариф площадки Сбербанк-АСТ",
+    # Ответ одной позицией покрыл бы только часть вопроса
+    "сколько стоит МЧД и ЭЦП",
+])
+def test_route_leaves_other_questions_to_gigachat(question):
+    assert intents.route(question) == (None, None)
+
+def test_price_item_answer_contains_price():
+    _, answer = intents.route("сколько стоит регистрация в ЕРУЗ")
+    assert "5 500 ₽" in answer
@@ -0,0 +1,140 @@
+import time
+import asyncio
+import limits
+
+def run(coro):
+    return asyncio.run(coro)
+
+def governor(initial=8, minimum=1, maximum=32):
+    return limits.ConcurrencyGovernor(initial=initial, minimum=minimum, maximum=maximum)
+
+def test_success_raises_limit_up_to_maximum():
+    g = governor(initial=2, maximum=3)
+    g.succeeded()
+    assert g.limit == 2.5
+    for _ in range(10):
+        g.succeeded()
+    assert g.limit == 3
+
+def test_overload_cuts_limit_once_per_window():
+    g = governor(initial=8)
+    for _ in range(3):
+        g.overloaded(retry_after=0.05)
+    stats = g.snapshot()
+    assert stats["limit"] == 4
+    assert stats["cuts"] == 1
+    assert stats["overloads"] == 3
+
+    # Окно закончилось — новая перегрузка снова снижает лимит
+    time.sleep(0.06)
+    g.overloaded(retry_after=0)
+    assert g.limit == 2
+    assert g.snapshot()["cuts"] == 2
+
+def test_overload_never_goes_below_minimum():
+    g = governor(initial=2, minimum=2)
+    g.overloaded(retry_after=0)
+    assert g.limit == 2
+
+def test_overload_of_request_sent_before_cut_is_ignored():
+    g = governor(initial=8)
+
+    async def scenario():
+        cut = asyncio.Event()
+
+        async def first():
+            async with g.slot("a"):
+                await asyncio.sleep(0.01)
+                g.overloaded(retry_after=0)
+                cut.set()
+
+        async def second():
+            async with g.slot("b"):
+                await cut.wait()
+                await asyncio.sleep(0.01)
+                # Окно уже закрыто, но запрос отправлен до снижения
+                g.overloaded(retry_after=0)
+
+        await asyncio.gather(first(), second())
+
+    run(scenario())
+    assert g.limit == 4
+    assert g.snapshot()["cuts"] == 1
+
+def test_retry_after_pauses_new_slots():
+    g = governor(initial=8)
+    g.overloaded(retry_after=0.2)
+    assert 0.1 < g.snapshot()["paused_for"] <= 0.2
+
+    async def scenario():
+        started = time.monotonic()
+        async with g.slot("a"):
+            return time.monotonic() - started
+
+    assert run(scenario()) >= 0.19
+
+def test_retry_after_is_capped():
+    g = governor()
+    g.overloaded(retry_after=limits.OVERLOAD_PAUSE_MAX * 10)
+    assert g.snapshot()["paused_for"] <= limits.OVERLOAD_PAUSE_MAX
+
+def test_retry_after_header_parsing():
+    assert limits.retry_after({"Retry-After": "3"}) == 3.0
+    assert limits.retry_after({"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"}) is None
+    assert limits.retry_after({}) is None
+
+def test_slots_alternate_between_chats():
+    g = governor(initial=1, maximum=1)
+    order = []
+
+    async def request(owner):
+        async with g.slot(owner):
+            order.append(owner)
+
+    async def scenario():
+        await g.acquire("holder")
+        tasks = [asyncio.create_task(request(owner)) for owner in ("a", "a", "a", "b", "b")]
+        await asyncio.sleep(0)
+        assert g.snapshot()["waiting"] == 5
+        assert g.snapshot()["waiting_chats"] == 2
+        g.release()
+        await asyncio.gather(*tasks)
+
+    run(scenario())
+    assert order == ["a", "b", "a", "b", "a"]
+    assert g.active == 0
+
+def test_cancelled_waiter_returns_granted_slot():
+    g = governor(initial=1, maximum=1)
+
+    async def scenario():
+        await g.acquire("holder")
+        first = asyncio.create_task(g.acquire("a"))
+        second = asyncio.create_task(g.acquire("b"))
+        await asyncio.sleep(0)
+        # Слот выдан первому, но тот отменён раньше, чем успел его занять
+        g.release()
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        assert first.cancelled()
+        assert g.active == 1
+        g.release()
+
+    run(scenario())
+    assert g.active == 0
+    assert g.snapshot()["waiting"] == 0
+
+def test_cancelled_waiter_leaves_queue():
+    g = governor(initial=1, maximum=1)
+
+    async def scenario():
+        await g.acquire("holder")
+        waiter = asyncio.create_task(g.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert g.snapshot()["waiting"] == 0
+        g.release()
+
+    run(scenario())
+    assert g.active == 0
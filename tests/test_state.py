@@ -0,0 +1,204 @@
+import time
+import asyncio
+import pytest
+import state
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    async def execute(self):
+        if self.redis.delay:
+            await asyncio.sleep(self.redis.delay)
+        if self.redis.fail_next:
+            self.redis.fail_next = False
+            raise ConnectionError("redis is down")
+        self.redis.pipelines += 1
+        for key, value, ex in self.commands:
+            self.redis.data[key] = (value, ex)
+
+class FakeRedis:
+    """Локальная замена redis.asyncio.Redis с нужными RedisStore командами"""
+
+    def __init__(self):
+        self.data = {}      # key -> (value, ex)
+        self.pipelines = 0
+        self.fail_next = False
+        self.delay = 0.0    # задержка выполнения pipeline, сек.
+        self.closed = False
+
+    async def get(self, key):
+        entry = self.data.get(key)
+        return entry[0] if entry else None
+
+    async def getdel(self, key):
+        entry = self.data.pop(key, None)
+        return entry[0] if entry else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def aclose(self):
+        self.closed = True
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture
+def redis_store():
+    client = FakeRedis()
+    return state.RedisStore(client=client, flush_interval=60), client
+
+def test_redis_writes_are_batched_until_flush(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.set_user_state(1, "manual_mode")
+        await store.remember_forward(10, 1)
+        assert client.data == {}
+        # Несброшенное значение уже читается
+        assert await store.get_user_state(1) == "manual_mode"
+        await store.flush()
+
+    run(scenario())
+    assert client.pipelines == 1
+    value, ex = client.data["tenderbot:user_state:1"]
+    assert value == '"manual_mode"'
+    assert 0 < ex <= state.USER_STATE_TTL
+    assert "tenderbot:forward:10" in client.data
+    assert store.snapshot()["written"] == 2
+
+def test_redis_reads_flushed_values(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.set_user_state(2, "manual_mode")
+        await store.flush()
+        return await store.get_user_state(2), await store.get_user_state(3)
+
+    assert run(scenario()) == ("manual_mode", "main")
+
+def test_redis_pop_forward_delivers_once(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.remember_forward(20, 7)
+        await store.remember_forward(21, 8)
+        await store.flush()
+        await store.remember_forward(22, 9)       # ещё не сброшено
+        return [await store.pop_forward(message_id) for message_id in (20, 21, 21, 22, 22)]
+
+    assert run(scenario()) == [7, 8, None, 9, None]
+    assert "tenderbot:forward:21" not in client.data
+
+def test_redis_failed_flush_keeps_newer_changes(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.set_user_state(1, "old")
+        client.fail_next = True
+        await store.flush()
+        await store.set_user_state(1, "new")
+        await store.flush()
+
+    run(scenario())
+    assert client.data["tenderbot:user_state:1"][0] == '"new"'
+
+def test_redis_close_flushes_and_closes_client(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.start()
+        await store.set_user_state(5, "manual_mode")
+        await store.close()
+
+    run(scenario())
+    assert "tenderbot:user_state:5" in client.data
+    assert client.closed
+
+def test_redis_batch_in_flight_stays_readable(redis_store):
+    store, client = redis_store
+    client.delay = 0.05
+
+    async def scenario():
+        await store.set_user_state(1, "manual_mode")
+        flush = asyncio.create_task(store.flush())
+        await asyncio.sleep(0.01)
+        during = await store.get_user_state(1)
+        await flush
+        return during, await store.get_user_state(1)
+
+    assert run(scenario()) == ("manual_mode", "manual_mode")
+
+def test_redis_pop_during_flush_is_not_restored(redis_store):
+    store, client = redis_store
+    client.delay = 0.05
+
+    async def scenario():
+        await store.remember_forward(40, 3)
+        flush = asyncio.create_task(store.flush())
+        await asyncio.sleep(0.01)
+        popped = [await store.pop_forward(40), await store.pop_forward(40)]
+        await flush
+        return popped, await store.pop_forward(40)
+
+    assert run(scenario()) == ([3, None], None)
+    assert "tenderbot:forward:40" not in client.data
+
+def test_redis_skips_expired_entries(redis_store):
+    store, client = redis_store
+
+    async def scenario():
+        await store.set(state.FORWARD, 30, 1, ttl=-1)
+        await store.flush()
+
+    run(scenario())
+    assert client.data == {}
+
+def test_sqlite_batches_and_survives_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def first():
+        store = state.SQLiteStore(path=path, flush_interval=60)
+        await store.set_user_state(1, "manual_mode")
+        await store.remember_forward(10, 1)
+        await store.remember_forward(11, 2)
+        await store.flush()
+        assert await store.pop_forward(11) == 2
+        await store.close()
+
+    async def second():
+        store = state.SQLiteStore(path=path, flush_interval=60)
+        try:
+            return (await store.get_user_state(1), await store.pop_forward(10),
+                    await store.pop_forward(10), await store.pop_forward(11))
+        finally:
+            await store.close()
+
+    run(first())
+    assert run(second()) == ("manual_mode", 1, None, None)
+
+def test_sqlite_ignores_expired_values(tmp_path):
+    async def scenario():
+        store = state.SQLiteStore(path=str(tmp_path / "state.db"), flush_interval=60)
+        await store.set(state.USER_STATE, 1, "manual_mode", ttl=0.05)
+        await store.flush()
+        time.sleep(0.1)
+        try:
+            return await store.get_user_state(1)
+        finally:
+            await store.close()
+
+    assert run(scenario()) == "main"
+
+def test_incomplete_backend_fails_on_creation():
+    class Incomplete(state.BatchingStore):
+        async def _read(self, namespace, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()